@@ -1,28 +1,85 @@
 # pyright: reportShadowedImports=false
 
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import time
+
 from faas import gcp
 from faas import azure
 from faas import aws
 from faas import alicloud
+import manifest
 import pulumi
+import regions
 import pulumi_docker_build as docker_build
 import pulumi_gcp as pgcp
 
 configblob = {}
 urls = {}
 configblob["urls"] = urls
+dispatch_targets = []
+# How ping-service reaches each pinger, see manifest.py.
+configblob["dispatch"] = {"version": manifest.VERSION, "targets": dispatch_targets}
+# Targets ping-service keeps pinging in the background, e.g.
+# `pulumi config set --path pingall:monitor.targets[0] https://example.com`.
+configblob["monitor"] = pulumi.Config().get_object("monitor") or {}
 
 service_account = pgcp.serviceaccount.Account(
     "ping-service-account", account_id="ping-service-account"
 )
 
-for provider in [gcp, azure, aws, alicloud]:
+providers = [gcp, azure, aws, alicloud]
+
+
+def timed(call):
+    start = time.perf_counter()
+    return call(), time.perf_counter() - start
+
+
+# Provider lookups (regions, account ids) block on the engine one at a time,
+# so run them all at once. Pulumi's settings live in context variables, which
+# each thread needs a copy of.
+discovery_start = time.perf_counter()
+with ThreadPoolExecutor() as pool:
+    lookups = {
+        provider: {
+            name: pool.submit(contextvars.copy_context().run, timed, call)
+            for name, call in provider.Deployer.discovery().items()
+        }
+        for provider in providers
+    }
+    discovered = {
+        provider: {name: future.result() for name, future in calls.items()}
+        for provider, calls in lookups.items()
+    }
+for provider, results in discovered.items():
+    timings = ", ".join(f"{name} {took:.2f}s" for name, (_, took) in results.items())
+    pulumi.info(f"Discovered {provider.__name__}: {timings}")
+pulumi.info(f"Discovery took {time.perf_counter() - discovery_start:.2f}s")
+# Region catalog changes and regions awaiting review, see regions.py.
+for log, note in regions.notes:
+    log(note)
+
+# Resources are registered one provider at a time, in a fixed order.
+for provider in providers:
     pulumi.info(f"Running: {provider.__name__}")
-    deployer = provider.Deployer(calling_service_account=service_account)
-    locations = deployer.list_locations()
+    results = {name: value for name, (value, _) in discovered[provider].items()}
+    deployer = provider.Deployer(
+        calling_service_account=service_account, discovered=results
+    )
+    locations = results["locations"]
 
     urls[provider.__name__] = {loc: deployer.make_function(loc) for loc in locations}
     deployer.finish()
+    for loc, url in urls[provider.__name__].items():
+        dispatch_targets.append(
+            manifest.entry(
+                provider.__name__.removeprefix("faas."),
+                loc,
+                url,
+                deployer.dispatch(loc),
+            )
+        )
 
 pulumi.export("urls", urls)
 
@@ -1,8 +1,14 @@
 use reqwest::Certificate;
 use serde::Deserialize;
-use std::net::ToSocketAddrs;
+use std::net::{IpAddr, SocketAddr, ToSocketAddrs};
+use std::sync::{Arc, OnceLock};
 use std::time::Duration;
 use std::{env, time::Instant};
+use tokio::io::{AsyncRead, AsyncReadExt, AsyncWrite, AsyncWriteExt};
+use tokio::net::{lookup_host, TcpStream};
+use tokio::time::timeout;
+use tokio_rustls::rustls::{self, pki_types::ServerName};
+use tokio_rustls::TlsConnector;
 use warp::{
     reject::{self},
     Filter, Rejection, Reply,
@@ -56,19 +62,230 @@ fn port() -> u16 {
     }
 }
 
-fn create_client_with_webpki_certs() -> Result<reqwest::Client, Box<dyn std::error::Error>> {
+fn create_client_with_webpki_certs() -> Result<reqwest::ClientBuilder, Box<dyn std::error::Error>> {
     let certs: Vec<Certificate> = webpki_root_certs::TLS_SERVER_ROOT_CERTS
         .iter()
         .map(|cert_der| Certificate::from_der(cert_der))
         .collect::<Result<Vec<_>, _>>()?;
-    let client = reqwest::Client::builder().tls_certs_only(certs).build()?;
+    Ok(reqwest::Client::builder().tls_certs_only(certs))
+}
 
-    Ok(client)
+// TLS settings for timed requests, built once. Only HTTP/1.1 is offered so
+// the request can be written straight onto the connection.
+fn tls_config() -> Arc<rustls::ClientConfig> {
+    static CONFIG: OnceLock<Arc<rustls::ClientConfig>> = OnceLock::new();
+    CONFIG
+        .get_or_init(|| {
+            let mut roots = rustls::RootCertStore::empty();
+            roots.add_parsable_certificates(
+                webpki_root_certs::TLS_SERVER_ROOT_CERTS.iter().cloned(),
+            );
+            let mut config = rustls::ClientConfig::builder_with_provider(Arc::new(
+                rustls::crypto::aws_lc_rs::default_provider(),
+            ))
+            .with_safe_default_protocol_versions()
+            .expect("default TLS versions")
+            .with_root_certificates(roots)
+            .with_no_client_auth();
+            config.alpn_protocols = vec![b"http/1.1".to_vec()];
+            Arc::new(config)
+        })
+        .clone()
 }
 
 #[derive(Deserialize)]
 pub struct URLQuery {
     url: String,
+    // Response format requested by ping-service. Absent for the legacy plain
+    // millisecond body.
+    format: Option<u8>,
+}
+
+const CONNECT_TIMEOUT: Duration = Duration::from_secs(10);
+const RESPONSE_TIMEOUT: Duration = Duration::from_secs(30);
+const MAX_HEAD: usize = 64 * 1024;
+
+// Timings for one measurement, encoded as format 1:
+//
+//   1;<total>;<dns>;<connect>;<tls>;<ttfb>;<status>;<ip>;<error>
+//
+// Times are milliseconds with microsecond precision. Fields that weren't
+// measured are left empty. Every phase is timed on the one connection the
+// request goes over: `connect` is its TCP handshake, `tls` its TLS
+// handshake, and `ttfb` runs from writing the request until the response
+// headers arrive. Redirects aren't followed, so `status` may be a 3xx.
+#[derive(Default)]
+struct Breakdown {
+    total: Option<Duration>,
+    dns: Option<Duration>,
+    connect: Option<Duration>,
+    tls: Option<Duration>,
+    ttfb: Option<Duration>,
+    status: Option<u16>,
+    ip: Option<IpAddr>,
+    error: Option<&'static str>,
+}
+
+fn millis(duration: Option<Duration>) -> String {
+    duration
+        .map(|d| format!("{:.3}", d.as_secs_f64() * 1000.0))
+        .unwrap_or_default()
+}
+
+impl Breakdown {
+    fn encode(&self) -> String {
+        format!(
+            "1;{};{};{};{};{};{};{};{}",
+            millis(self.total),
+            millis(self.dns),
+            millis(self.connect),
+            millis(self.tls),
+            millis(self.ttfb),
+            self.status.map(|s| s.to_string()).unwrap_or_default(),
+            self.ip.map(|ip| ip.to_string()).unwrap_or_default(),
+            self.error.unwrap_or_default(),
+        )
+    }
+
+    async fn resolve(&mut self, host: &str, port: u16) -> Result<SocketAddr, &'static str> {
+        let start = Instant::now();
+        let addr = lookup_host((host, port))
+            .await
+            .map_err(|_| "dns")?
+            .next()
+            .ok_or("dns")?;
+        self.dns = Some(start.elapsed());
+        self.ip = Some(addr.ip());
+        Ok(addr)
+    }
+
+    async fn connect(&mut self, addr: SocketAddr) -> Result<TcpStream, &'static str> {
+        let start = Instant::now();
+        let stream = timeout(CONNECT_TIMEOUT, TcpStream::connect(addr))
+            .await
+            .map_err(|_| "connect_timeout")?
+            .map_err(|_| "connect")?;
+        self.connect = Some(start.elapsed());
+        Ok(stream)
+    }
+
+    async fn handshake(
+        &mut self,
+        stream: TcpStream,
+        host: &str,
+    ) -> Result<tokio_rustls::client::TlsStream<TcpStream>, &'static str> {
+        let name = ServerName::try_from(host.to_owned()).map_err(|_| "bad_url")?;
+        let start = Instant::now();
+        let stream = timeout(
+            CONNECT_TIMEOUT,
+            TlsConnector::from(tls_config()).connect(name, stream),
+        )
+        .await
+        .map_err(|_| "tls_timeout")?
+        .map_err(|_| "tls")?;
+        self.tls = Some(start.elapsed());
+        Ok(stream)
+    }
+
+    // Sends a GET for `target` and waits for the end of the response headers.
+    async fn exchange<S: AsyncRead + AsyncWrite + Unpin>(
+        &mut self,
+        mut stream: S,
+        authority: &str,
+        target: &str,
+    ) -> Result<(), &'static str> {
+        let request = format!(
+            "GET {target} HTTP/1.1\r\nHost: {authority}\r\nUser-Agent: pinger\r\n\
+             Accept: */*\r\nConnection: close\r\n\r\n"
+        );
+        let start = Instant::now();
+        let head = timeout(RESPONSE_TIMEOUT, async {
+            stream.write_all(request.as_bytes()).await?;
+            let mut head = Vec::with_capacity(1024);
+            let mut buf = [0u8; 4096];
+            while !head.windows(4).any(|w| w == b"\r\n\r\n") && head.len() < MAX_HEAD {
+                let read = stream.read(&mut buf).await?;
+                if read == 0 {
+                    break;
+                }
+                head.extend_from_slice(&buf[..read]);
+            }
+            Ok::<_, std::io::Error>(head)
+        })
+        .await
+        .map_err(|_| "timeout")?
+        .map_err(|_| "request")?;
+        self.ttfb = Some(start.elapsed());
+        self.status = Some(status_code(&head).ok_or("response")?);
+        Ok(())
+    }
+
+    async fn measure_tcp(&mut self, target: &str) -> Result<(), &'static str> {
+        let (host, port) = target.rsplit_once(':').ok_or("bad_addr")?;
+        let port: u16 = port.parse().map_err(|_| "bad_addr")?;
+        let host = host.trim_start_matches('[').trim_end_matches(']');
+        let addr = self.resolve(host, port).await?;
+        self.connect(addr).await?;
+        self.total = Some(self.dns.unwrap_or_default() + self.connect.unwrap_or_default());
+        Ok(())
+    }
+
+    async fn measure_http(&mut self, target: &str) -> Result<(), &'static str> {
+        let url = reqwest::Url::parse(target).map_err(|_| "bad_url")?;
+        let tls = match url.scheme() {
+            "https" => true,
+            "http" => false,
+            _ => return Err("bad_url"),
+        };
+        let authority = url.host_str().ok_or("bad_url")?;
+        let host = authority.trim_start_matches('[').trim_end_matches(']');
+        let port = url.port_or_known_default().ok_or("bad_url")?;
+        let authority = match url.port() {
+            Some(port) => format!("{authority}:{port}"),
+            None => authority.to_owned(),
+        };
+        let mut path = url.path().to_owned();
+        if let Some(query) = url.query() {
+            path = format!("{path}?{query}");
+        }
+        let addr = self.resolve(host, port).await?;
+        let stream = self.connect(addr).await?;
+        if tls {
+            let stream = self.handshake(stream, host).await?;
+            self.exchange(stream, &authority, &path).await?;
+        } else {
+            self.exchange(stream, &authority, &path).await?;
+        }
+        self.total = Some(
+            [self.dns, self.connect, self.tls, self.ttfb]
+                .into_iter()
+                .flatten()
+                .sum(),
+        );
+        Ok(())
+    }
+
+    async fn measure(target: &str) -> Breakdown {
+        let mut breakdown = Breakdown::default();
+        let result = match target.strip_prefix("tcp://") {
+            Some(addr) => breakdown.measure_tcp(addr).await,
+            None => breakdown.measure_http(target).await,
+        };
+        if let Err(error) = result {
+            breakdown.error = Some(error);
+        }
+        breakdown
+    }
+}
+
+// The status code from the first line of a response head.
+fn status_code(head: &[u8]) -> Option<u16> {
+    let line = head.split(|&b| b == b'\r').next()?;
+    let mut parts = line.split(|&b| b == b' ');
+    if !parts.next()?.starts_with(b"HTTP/") {
+        return None;
+    }
+    std::str::from_utf8(parts.next()?).ok()?.parse().ok()
 }
 
 #[derive(Debug)]
@@ -82,6 +299,11 @@ enum Error {
 impl warp::reject::Reject for Error {}
 
 pub async fn fetch_url(query: URLQuery) -> Result<impl Reply, Rejection> {
+    if query.format == Some(1) {
+        // Failures are reported in the body so they can't be mistaken for
+        // timings.
+        return Ok(Breakdown::measure(&query.url).await.encode());
+    }
     if query.url.starts_with("tcp://") {
         let start = Instant::now();
         let saddr = query.url[6..]
@@ -95,7 +317,7 @@ pub async fn fetch_url(query: URLQuery) -> Result<impl Reply, Rejection> {
         Ok(format!("{:}", duration.as_millis()))
     } else {
         let start = Instant::now();
-        let client = create_client_with_webpki_certs().unwrap();
+        let client = create_client_with_webpki_certs().unwrap().build().unwrap();
         let response = client
             .get(query.url)
             .send()
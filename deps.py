@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
+import hashlib
+import json
 import os
 import subprocess
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import pulumi
 
 depNames = [
@@ -11,33 +15,114 @@ depNames = [
     "alicloud.archive",
 ]
 
-pulumi.info("Loading nix dependencies...")
-
-nix_env = os.environ.copy()
-nix_env["NIXPKGS_ALLOW_UNFREE"] = "1"
-
-drvs = (
-    subprocess.run(
-        [
-            "nix",
-            "build",
-            "--impure",
-            "--print-out-paths",
-            "--system",
-            "x86_64-linux",
-        ]
-        + sum(
-            ([f"{os.path.dirname(os.path.realpath(__file__))}#{x}"] for x in depNames),
-            [],
-        ),
-        env=nix_env,
-        check=True,
-        stdout=subprocess.PIPE,
+root = os.path.dirname(os.path.realpath(__file__))
+# Store paths of the last build, keyed by a hash of everything it was built
+# from, so unchanged sources skip nix entirely.
+cache_path = os.path.join(root, ".cache", "nixdeps.json")
+# Build inputs; build output directories are skipped.
+sources = ["flake.nix", "flake.lock", "nix", "app"]
+ignored = {"target", "result", ".git"}
+
+
+def source_files():
+    for source in sources:
+        path = os.path.join(root, source)
+        if os.path.isfile(path):
+            yield path
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if d not in ignored)
+            for name in sorted(filenames):
+                yield os.path.join(dirpath, name)
+
+
+def source_hash() -> str:
+    digest = hashlib.sha256(json.dumps(depNames).encode())
+    for path in source_files():
+        digest.update(os.path.relpath(path, root).encode() + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def cached(key: str):
+    try:
+        with open(cache_path) as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    paths = entry.get("paths", {})
+    if entry.get("key") != key or set(paths) != set(depNames):
+        return None
+    # The store may have been garbage collected since.
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    return paths
+
+
+def build(key: str) -> dict:
+    nix_env = os.environ.copy()
+    nix_env["NIXPKGS_ALLOW_UNFREE"] = "1"
+
+    drvs = (
+        subprocess.run(
+            [
+                "nix",
+                "build",
+                "--impure",
+                "--print-out-paths",
+                "--system",
+                "x86_64-linux",
+            ]
+            + sum(
+                ([f"{root}#{x}"] for x in depNames),
+                [],
+            ),
+            env=nix_env,
+            check=True,
+            stdout=subprocess.PIPE,
+        )
+        .stdout.decode()
+        .split("\n")
     )
-    .stdout.decode()
-    .split("\n")
-)
+    paths = {name: drv.strip() for name, drv in zip(depNames, drvs)}
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump({"key": key, "paths": paths}, f, indent=2)
+    return paths
+
+
+class LazyDeps(Mapping):
+    """
+    The nix outputs by name, building in the background; the first lookup
+    waits for the build to finish.
+    """
+
+    def __init__(self, future):
+        self.future = future
+        self.paths = None
+
+    def _resolve(self) -> dict:
+        if self.paths is None:
+            self.paths = self.future.result()
+            pulumi.info("Dependencies loaded.")
+        return self.paths
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
 
-nixdeps = {name: drv.strip() for name, drv in zip(depNames, drvs)}
 
-pulumi.info("Dependencies loaded.")
+key = source_hash()
+nixdeps = cached(key)
+if nixdeps is not None:
+    pulumi.info("Nix dependencies unchanged, reusing the last build.")
+else:
+    pulumi.info("Loading nix dependencies...")
+    # Builds while the providers are discovered; nothing needs the outputs
+    # until the first function is made.
+    nixdeps = LazyDeps(ThreadPoolExecutor(max_workers=1).submit(build, key))
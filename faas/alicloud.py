@@ -2,40 +2,30 @@ import pulumi
 import pulumi_alicloud as alicloud
 from deps import nixdeps
 import json
+import regions
 import pulumi_gcp as gcp
 
 
 class Deployer:
     @staticmethod
-    def list_locations() -> list[str]:
-        # Returns regions that we can't use for whatever reason.
-        # return alicloud.get_regions().ids
-        return [
-            # "cn-qingdao",
-            "cn-beijing",
-            "cn-huhehaote",
-            "cn-zhangjiakou",
-            # "cn-shanghai",
-            "cn-hongkong",
-            "cn-hangzhou",
-            "ap-southeast-1",
-            "cn-chengdu",
-            # "cn-shenzhen",
-            "us-west-1",
-            "ap-northeast-1",
-            "ap-northeast-2",
-            "eu-central-1",
-            # "ap-south-1",
-            "ap-southeast-3",
-            "us-east-1",
-            # "ap-southeast-2",
-            "ap-southeast-5",
-            "ap-southeast-7",
-            "eu-west-1",
-        ]
+    def available_locations() -> list[str]:
+        return alicloud.get_regions().ids
 
-    def __init__(self, calling_service_account: gcp.serviceaccount.Account):
-        self.account_id = alicloud.get_caller_identity().account_id
+    @classmethod
+    def list_locations(cls) -> list[str]:
+        return regions.locations("alicloud", cls.available_locations)
+
+    @classmethod
+    def discovery(cls):
+        return {
+            "locations": cls.list_locations,
+            "account_id": lambda: alicloud.get_caller_identity().account_id,
+        }
+
+    def __init__(
+        self, calling_service_account: gcp.serviceaccount.Account, discovered: dict
+    ):
+        self.account_id = discovered["account_id"]
         # alicloud.ims.OidcProvider(
         #     "google",
         #     issuer_url="https://accounts.google.com",
@@ -133,5 +123,8 @@ class Deployer:
 
         return trigger.http_trigger.url_internet
 
+    def dispatch(self, location: str) -> dict:
+        return {"auth": "none"}
+
     def finish(self):
         pass
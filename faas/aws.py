@@ -1,22 +1,120 @@
 import pulumi
 import pulumi_aws as aws
 from deps import nixdeps
+import regions
 import json
+import os
 import pulumi_gcp as gcp
 import pulumi_std as std
 import socket
+import threading
+import time
+
+# Whether each region has Lambda function URLs, so deploys don't probe and a
+# flaky resolver can't move a region onto API Gateway. It's committed next
+# to the region catalog and re-probed on the same PINGALL_REFRESH_REGIONS=1;
+# otherwise only regions missing from it are probed.
+CAPABILITY_CACHE = os.path.join(regions.root, "catalog", "aws-function-urls.json")
+PROBE_TIMEOUT = 10
+PROBE_ATTEMPTS = 3
+
+
+def _probe(location: str):
+    """
+    True or False when DNS gives a definite answer about the region's
+    function URL domain, None when it doesn't (timeouts, EAI_AGAIN, ...).
+    """
+    try:
+        socket.getaddrinfo(f"a.lambda-url.{location}.on.aws", 443)
+        return True
+    except socket.gaierror as e:
+        if e.errno in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", None)):
+            return False
+        return None
+
+
+def _probe_all(locations: list[str]) -> dict:
+    """
+    Probes every location at once, with None for those that didn't answer
+    within PROBE_TIMEOUT. The threads are daemons, so a lookup that hangs
+    can't hold up the program's exit.
+    """
+    answers = {}
+
+    def probe(location):
+        answers[location] = _probe(location)
+
+    threads = [
+        threading.Thread(target=probe, args=(location,), daemon=True)
+        for location in locations
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + PROBE_TIMEOUT
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    return {location: answers.get(location) for location in locations}
+
+
+def function_url_support(locations: list[str]) -> dict[str, bool]:
+    try:
+        with open(CAPABILITY_CACHE) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        cache = {}
+    unknown = [loc for loc in locations if regions.REFRESH or loc not in cache]
+    if not unknown:
+        return {loc: cache[loc] for loc in locations}
+    answered = {}
+    for _ in range(PROBE_ATTEMPTS):
+        answers = _probe_all(unknown)
+        for loc, supported in answers.items():
+            if supported is not None:
+                answered[loc] = supported
+        unknown = [loc for loc in answers if answers[loc] is None]
+        if not unknown:
+            break
+    # A known answer is better than a guess; only new regions have to wait.
+    unknown = [loc for loc in unknown if loc not in cache]
+    cache.update(answered)
+    with open(CAPABILITY_CACHE, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+        f.write("\n")
+    if unknown:
+        raise RuntimeError(
+            f"Couldn't tell whether {', '.join(unknown)} support Lambda function "
+            "URLs (DNS timed out or failed temporarily), try again"
+        )
+    return {loc: cache[loc] for loc in locations}
 
 
 class Deployer:
     apigws = []
-    lambdas = []
+    # Every pinger, by region, for ping-service's Lambda Invoke transport.
+    function_arns = {}
 
     @staticmethod
-    def list_locations() -> list[str]:
+    def available_locations() -> list[str]:
         return aws.get_regions().names
 
-    def __init__(self, calling_service_account: gcp.serviceaccount.Account):
-        self.account_id = aws.get_caller_identity().account_id
+    @classmethod
+    def list_locations(cls) -> list[str]:
+        return regions.locations("aws", cls.available_locations)
+
+    @classmethod
+    def discovery(cls):
+        return {
+            "locations": cls.list_locations,
+            "account_id": lambda: aws.get_caller_identity().account_id,
+            # list_locations is looked up once; this waits on that lookup.
+            "function_urls": lambda: function_url_support(cls.list_locations()),
+        }
+
+    def __init__(
+        self, calling_service_account: gcp.serviceaccount.Account, discovered: dict
+    ):
+        self.account_id = discovered["account_id"]
+        self.function_urls = discovered["function_urls"]
         calling_service_account.unique_id
         self.ping_service_role = aws.iam.Role(
             "ping-service-role",
@@ -81,6 +179,7 @@ class Deployer:
             ),
             region=location,
         )
+        self.function_arns[location] = lambda_.arn
 
         lambda_logging = aws.iam.Policy(
             f"lambdaLogging-{location}",
@@ -115,13 +214,7 @@ class Deployer:
             policy_arn=lambda_logging.arn,
         )
 
-        try:
-            socket.getaddrinfo(f"a.lambda-url.{location}.on.aws", 443)
-            function_url_suport = True
-        except socket.gaierror:
-            function_url_suport = False
-
-        if not function_url_suport:
+        if not self.function_urls[location]:
             apigw = aws.apigateway.RestApi(
                 f"restApiGateway-{location}",
                 endpoint_configuration=aws.apigateway.RestApiEndpointConfigurationArgs(
@@ -215,9 +308,18 @@ class Deployer:
                 authorization_type="AWS_IAM",
                 region=location,
             ).function_url
-            self.lambdas.append(lambda_)
         return url
 
+    def dispatch(self, location: str) -> dict:
+        return {
+            "auth": "sigv4",
+            "signing_service": (
+                "lambda" if self.function_urls[location] else "execute-api"
+            ),
+            "signing_region": location,
+            "function_arn": self.function_arns[location],
+        }
+
     def finish(self):
         invoke_policy = aws.iam.Policy(
             "lambdaInvoke",
@@ -238,7 +340,9 @@ class Deployer:
                                 pulumi.Output.format("{0}/*/*", apigw.execution_arn)
                                 for apigw in self.apigws
                             ]
-                            + [lambda_.arn for lambda_ in self.lambdas],
+                            # All pingers, not just those behind a function URL,
+                            # can be called with Lambda Invoke.
+                            + list(self.function_arns.values()),
                         }
                     ],
                 }
@@ -1,77 +1,49 @@
 import pulumi
 import pulumi_azure_native as azure
 from deps import nixdeps
+import json
 import pulumi_gcp as gcp
+import regions
+import urllib.request
 
 
 class Deployer:
     @staticmethod
-    def list_locations() -> list[str]:
-        # TODO: Get This from the API
+    def available_locations() -> list[str]:
+        # azure-native has no invoke for this, so ask Resource Manager.
+        subscription_id = azure.authorization.get_client_config().subscription_id
+        token = azure.authorization.get_client_token().token
+        request = urllib.request.Request(
+            f"https://management.azure.com/subscriptions/{subscription_id}"
+            "/locations?api-version=2022-12-01",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = json.load(response)
+        # Logical regions ("europe", "global", ...) can't host anything.
         return [
-            # "australiacentral",
-            # "australiacentral2",
-            "australiaeast",
-            "australiasoutheast",
-            "brazilsouth",
-            # "brazilsoutheast",
-            # "brazilus",
-            "canadacentral",
-            "canadaeast",
-            "centralindia",
-            "centralus",
-            # "centraluseuap",
-            "eastasia",
-            "eastus",
-            "eastus2",
-            # "eastus2euap",
-            # "eastusstg",
-            "francecentral",
-            # "francesouth",
-            # "germanynorth",
-            "germanywestcentral",
-            # "israelcentral",
-            # "italynorth",
-            "japaneast",
-            "japanwest",
-            # "jioindiacentral",
-            # "jioindiawest",
-            "koreacentral",
-            # "koreasouth",
-            # "mexicocentral",
-            # "newzealandnorth",
-            "northcentralus",
-            "northeurope",
-            "norwayeast",
-            # "norwaywest",
-            # "polandcentral",
-            # "qatarcentral",
-            "southafricanorth",
-            # "southafricawest",
-            "southcentralus",
-            # "southcentralusstg",
-            "southeastasia",
-            "southindia",
-            # "spaincentral",
-            "swedencentral",
-            "switzerlandnorth",
-            # "switzerlandwest",
-            # "uaecentral",
-            "uaenorth",
-            "uksouth",
-            "ukwest",
-            "westcentralus",
-            "westeurope",
-            "westindia",
-            "westus",
-            "westus2",
-            # "westus3",
+            location["name"]
+            for location in body["value"]
+            if location.get("metadata", {}).get("regionType") == "Physical"
         ]
 
-    def __init__(self, calling_service_account: gcp.serviceaccount.Account):
+    @classmethod
+    def list_locations(cls) -> list[str]:
+        return regions.locations("azure", cls.available_locations)
+
+    @classmethod
+    def discovery(cls):
+        return {
+            "locations": cls.list_locations,
+            "subscription_id": lambda: azure.authorization.get_client_config().subscription_id,
+        }
+
+    def __init__(
+        self, calling_service_account: gcp.serviceaccount.Account, discovered: dict
+    ):
         self.resource_group = azure.resources.ResourceGroup("pingall")
 
-        self.subscription_id = azure.authorization.get_client_config().subscription_id
+        self.subscription_id = discovered["subscription_id"]
 
     def make_function(self, location: str) -> pulumi.Output[str]:
         code_storage_account = azure.storage.StorageAccount(
@@ -186,5 +158,8 @@ class Deployer:
         )
         return app.default_host_name.apply(lambda host: f"https://{host}/api/pinger")
 
+    def dispatch(self, location: str) -> dict:
+        return {"auth": "none"}
+
     def finish(self):
         pass
@@ -5,17 +5,25 @@ import pulumi_containerregistry as containerregistry
 import pulumi_gcp as gcp
 
 from deps import nixdeps
+import regions
 
 
 class Deployer:
     @staticmethod
-    def list_locations() -> list[str]:
-        return filter(
-            lambda loc: loc not in {"me-central2", "europe-north2"},
-            gcp.cloudrun.get_locations().locations,
-        )
+    def available_locations() -> list[str]:
+        return gcp.cloudrun.get_locations().locations
+
+    @classmethod
+    def list_locations(cls) -> list[str]:
+        return regions.locations("gcp", cls.available_locations)
 
-    def __init__(self, calling_service_account: gcp.serviceaccount.Account):
+    @classmethod
+    def discovery(cls):
+        return {"locations": cls.list_locations}
+
+    def __init__(
+        self, calling_service_account: gcp.serviceaccount.Account, discovered: dict
+    ):
         self.calling_service_account = calling_service_account
 
         # Import the provider's configuration settings.
@@ -87,5 +95,9 @@ class Deployer:
         )
         return service.uri
 
+    def dispatch(self, location: str) -> dict:
+        # Callers present a Google ID token with the "pinger" audience.
+        return {"auth": "id_token"}
+
     def finish(self):
         pass
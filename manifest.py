@@ -0,0 +1,88 @@
+"""
+The dispatch manifest written to config.json for ping-service: one entry per
+pinger with everything needed to call it, worked out at deploy time.
+"""
+
+import re
+from urllib.parse import urlsplit
+
+import pulumi
+
+VERSION = 1
+
+# Region names that the rules below would get wrong.
+_EXACT = {
+    # Azure's Brazil-paired region is in the US.
+    "brazilus": "north-america",
+}
+# Region name prefixes (AWS, GCP, Alicloud) and words (Azure) by geography,
+# checked in order.
+_PREFIXES = [
+    (("us-", "ca-", "mx-", "northamerica-"), "north-america"),
+    (("sa-", "southamerica-"), "south-america"),
+    (("eu-", "europe-"), "europe"),
+    (("me-", "il-"), "middle-east"),
+    (("af-", "africa-"), "africa"),
+    (("ap-", "asia-", "australia-", "cn-"), "asia-pacific"),
+]
+_WORDS = [
+    (("southafrica",), "africa"),
+    (("uae", "qatar", "israel", "saudi"), "middle-east"),
+    (
+        (
+            "australia", "newzealand", "india", "asia", "japan", "korea",
+            "china", "taiwan", "indonesia", "malaysia",
+        ),
+        "asia-pacific",
+    ),
+    (("brazil", "chile"), "south-america"),
+    (
+        (
+            "europe", "uk", "france", "germany", "norway", "sweden",
+            "switzerland", "poland", "italy", "spain", "austria", "belgium",
+            "denmark", "finland", "greece",
+        ),
+        "europe",
+    ),
+    (("canada", "mexico"), "north-america"),
+]
+# Azure's US regions: eastus, westus2, centraluseuap, southcentralusstg, ...
+_AZURE_US = re.compile(r"us\d*(euap|stg)?$")
+
+
+def geography(location: str) -> str:
+    """Normalises a provider's region name to a broad geography."""
+    if location in _EXACT:
+        return _EXACT[location]
+    for prefixes, area in _PREFIXES:
+        if location.startswith(prefixes):
+            return area
+    for words, area in _WORDS:
+        if any(word in location for word in words):
+            return area
+    if _AZURE_US.search(location):
+        return "north-america"
+    return "other"
+
+
+def _entry(provider: str, location: str, url: str, dispatch: dict) -> dict:
+    parts = urlsplit(url)
+    return {
+        "provider": provider,
+        "region": location,
+        "geography": geography(location),
+        "url": url,
+        "host": parts.netloc,
+        "path": parts.path or "/",
+        **dispatch,
+    }
+
+
+def entry(provider: str, location: str, url, dispatch: dict) -> pulumi.Output:
+    """
+    The manifest entry for one pinger. `dispatch` is the auth the provider's
+    Deployer reports for the location; it and `url` may hold Outputs.
+    """
+    return pulumi.Output.all(url, pulumi.Output.from_input(dispatch)).apply(
+        lambda args: _entry(provider, location, args[0], args[1])
+    )
@@ -0,0 +1,67 @@
+"""
+Parsing of the bodies returned by the pinger functions.
+
+ping-service asks for `format=1`, answered with
+
+    1;<total>;<dns>;<connect>;<tls>;<ttfb>;<status>;<ip>;<error>
+
+where times are milliseconds and unmeasured fields are empty. Pingers that
+predate the format ignore the parameter and reply with the total as a plain
+integer, or an error message.
+"""
+
+from typing import NamedTuple, Optional
+
+FORMAT_VERSION = 1
+QUERY = {"format": str(FORMAT_VERSION)}
+
+_PREFIX = b"1;"
+_FIELDS = 9
+
+
+class PingerResult(NamedTuple):
+    # 0 for a legacy plain-integer body.
+    version: int
+    total_ms: Optional[float] = None
+    dns_ms: Optional[float] = None
+    connect_ms: Optional[float] = None
+    tls_ms: Optional[float] = None
+    ttfb_ms: Optional[float] = None
+    status: Optional[int] = None
+    ip: Optional[str] = None
+    error: Optional[str] = None
+
+
+def _ms(field: bytes) -> Optional[float]:
+    return float(field) if field else None
+
+
+def parse(body: bytes, http_status: int = 200) -> PingerResult:
+    """
+    Parses a pinger body without decoding it first; numbers are read
+    straight from the bytes.
+    """
+    if body.startswith(_PREFIX):
+        fields = body.split(b";", _FIELDS - 1)
+        if len(fields) == _FIELDS:
+            try:
+                return PingerResult(
+                    FORMAT_VERSION,
+                    _ms(fields[1]),
+                    _ms(fields[2]),
+                    _ms(fields[3]),
+                    _ms(fields[4]),
+                    _ms(fields[5]),
+                    int(fields[6]) if fields[6] else None,
+                    fields[7].decode() or None,
+                    fields[8].decode().strip() or None,
+                )
+            except ValueError:
+                pass
+    # Tolerates the trailing newline some runtimes add to a plain body.
+    if http_status == 200 and body.strip().isdigit():
+        return PingerResult(0, float(body))
+    return PingerResult(
+        0,
+        error=body.decode(errors="replace").strip() or f"HTTP {http_status}",
+    )
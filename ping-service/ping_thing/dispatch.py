@@ -0,0 +1,94 @@
+"""
+The dispatch manifest: how to reach and authenticate to every pinger.
+
+The Pulumi program writes it to `config.json` as
+
+    {"version": 1, "targets": [{"provider": "aws", "region": "eu-west-1",
+      "geography": "europe", "url": "https://....on.aws/", "host": "....on.aws",
+      "path": "/", "auth": "sigv4", "signing_service": "lambda",
+      "signing_region": "eu-west-1", "function_arn": "arn:aws:lambda:..."}, ...]}
+
+and it is read once at startup, so requests only look records up.
+"""
+
+from typing import Dict, Iterator, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+MANIFEST_VERSION = 1
+
+# Auth kinds.
+ID_TOKEN = "id_token"
+SIGV4 = "sigv4"
+NONE = "none"
+
+
+class Target(NamedTuple):
+    provider: str
+    region: str
+    geography: Optional[str]
+    url: str
+    host: str
+    path: str
+    auth: str
+    signing_service: Optional[str] = None
+    signing_region: Optional[str] = None
+    function_arn: Optional[str] = None
+
+
+class Targets:
+    """Targets by provider and region, in manifest order."""
+
+    def __init__(self, targets):
+        self.by_provider: Dict[str, Dict[str, Target]] = {}
+        for target in targets:
+            self.by_provider.setdefault(target.provider, {})[target.region] = target
+
+    def __getitem__(self, key) -> Target:
+        provider, region = key
+        return self.by_provider[provider][region]
+
+    def __iter__(self) -> Iterator[Target]:
+        for regions in self.by_provider.values():
+            yield from regions.values()
+
+    def __len__(self) -> int:
+        return sum(len(regions) for regions in self.by_provider.values())
+
+
+def _from_urls(urls: dict, function_arns: dict) -> Iterator[Target]:
+    """Targets for a config.json written before the manifest existed."""
+    auth = {"gcp": ID_TOKEN, "aws": SIGV4}
+    for key, regions in urls.items():
+        provider = key.removeprefix("faas.")
+        for region, url in regions.items():
+            parts = urlsplit(url)
+            signing = None
+            if provider == "aws":
+                signing = "lambda" if "lambda" in url else "execute-api"
+            yield Target(
+                provider=provider,
+                region=region,
+                geography=None,
+                url=url,
+                host=parts.netloc,
+                path=parts.path or "/",
+                auth=auth.get(provider, NONE),
+                signing_service=signing,
+                signing_region=region if signing else None,
+                function_arn=function_arns.get(region) if provider == "aws" else None,
+            )
+
+
+def load(config: dict) -> Targets:
+    manifest = config.get("dispatch")
+    if manifest is None:
+        return Targets(_from_urls(config["urls"], config.get("aws_function_arns", {})))
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(
+            f"Dispatch manifest version {manifest.get('version')} isn't supported"
+            f" (expected {MANIFEST_VERSION})"
+        )
+    return Targets(
+        Target(**{field: entry.get(field) for field in Target._fields})
+        for entry in manifest["targets"]
+    )
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Sequence, Tuple
+
+from ping_thing.shared_cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+Target = Tuple[str, str]
+
+# The token bucket and rotation position, shared by all workers.
+STATE_KEY = "keep_warm:state"
+STATE_TTL = 24 * 3600
+
+
+class KeepWarm:
+    """
+    Periodically sends lightweight pings to every region so scale-to-zero
+    functions stay warm and pooled connections to them stay open.
+
+    `budget` caps the number of warm-up calls per hour (0 for no cap). When a
+    round can't afford every region, it warms as many as it can and the next
+    round carries on from where it stopped, so every region is reached in turn.
+    The budget and position are kept in `cache`, so they hold across workers
+    whichever of them runs a round.
+    """
+
+    def __init__(
+        self,
+        targets: Callable[[], Sequence[Target]],
+        warm: Callable[[List[Target]], Awaitable[None]],
+        interval: float,
+        budget: int = 0,
+        claim: Callable[[], Awaitable[bool]] = None,
+        cache=None,
+    ):
+        self.targets = targets
+        self.warm = warm
+        self.interval = interval
+        self.budget = budget
+        # Lets only one of several workers run a given round.
+        self.claim = claim
+        self.cache = cache if cache is not None else LocalCache()
+
+    def _allowance(self, state: dict, wanted: int) -> int:
+        if not self.budget:
+            return wanted
+        # Wall clock, as workers don't share a monotonic one.
+        now = time.time()
+        state["tokens"] = min(
+            self.budget,
+            state["tokens"] + (now - state["refilled"]) * self.budget / 3600,
+        )
+        state["refilled"] = now
+        allowed = min(wanted, int(state["tokens"]))
+        state["tokens"] -= allowed
+        return allowed
+
+    async def round(self):
+        targets = list(self.targets())
+        state = await self.cache.get(STATE_KEY)
+        if state is None:
+            state = {"tokens": float(self.budget), "refilled": time.time(), "next": 0}
+        allowed = self._allowance(state, len(targets))
+        batch = []
+        if targets and allowed:
+            start = state["next"] % len(targets)
+            batch = (targets[start:] + targets[:start])[:allowed]
+            state["next"] = start + allowed
+        # Saved before warming, so a slow round can't be spent twice.
+        await self.cache.set(STATE_KEY, state, STATE_TTL)
+        if batch:
+            await self.warm(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if self.claim is None or await self.claim():
+                    await self.round()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("keep-warm round failed")
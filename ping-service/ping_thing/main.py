@@ -1,7 +1,10 @@
 import asyncio
+import datetime
 import json
 import os
-from typing import List
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 
 import aioboto3
 import aiohttp
@@ -11,16 +14,58 @@ import jwt
 
 from botocore import auth, awsrequest
 from botocore.credentials import Credentials
-from fastapi import Depends, FastAPI, HTTPException, Response, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from google.cloud import storage
 from pydantic import BaseModel
-from cache import AsyncTTL
+
+from ping_thing import contract, dispatch, profiling, shared_cache, streaming
+from ping_thing.keep_warm import KeepWarm
+from ping_thing.monitor import Monitor
+from ping_thing.transport import Response as TransportResponse
+from ping_thing.transport import LambdaInvokeTransport, Transport, Transports
 
 aws = aioboto3.Session()
 
+# Shared between workers when running under `ping_thing.serve`.
+cache = shared_cache.from_env()
+
+JWKS_TTL = float(os.getenv("JWKS_TTL", "3600"))
+# Results for the same target are reused for this many seconds, off by default.
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "0"))
+# Refresh tokens and credentials this long before they expire.
+EXPIRY_MARGIN = 300
+
+# Seconds between keep-warm rounds, off by default.
+KEEP_WARM_INTERVAL = float(os.getenv("KEEP_WARM_INTERVAL", "0"))
+# Maximum keep-warm calls per hour, 0 for no limit.
+KEEP_WARM_BUDGET = int(os.getenv("KEEP_WARM_BUDGET", "0"))
+# Something cheap for the pingers to measure while warming up.
+KEEP_WARM_URL = os.getenv("KEEP_WARM_URL", "tcp://1.1.1.1:443")
+# A round trip this much longer than the latency the function reports is
+# most likely a cold start.
+COLD_START_THRESHOLD_MS = float(os.getenv("COLD_START_THRESHOLD_MS", "1000"))
+
+# Records that finish close together are sent in one write: a batch is flushed
+# after STREAM_FLUSH_MS or once it holds STREAM_FLUSH_RECORDS records. The first
+# record always goes out on its own. 0 sends every record as it comes.
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "5"))
+STREAM_FLUSH_RECORDS = int(os.getenv("STREAM_FLUSH_RECORDS", "8"))
+
+# AWS regions, comma separated or `*` for all, whose pingers are called with
+# Lambda Invoke rather than through their function URL or API Gateway.
+AWS_INVOKE_REGIONS = {
+    region.strip()
+    for region in os.getenv("AWS_INVOKE_REGIONS", "").split(",")
+    if region.strip()
+}
+
+# `claim=value` an Access token needs to profile requests, e.g.
+# `groups=ping-service-admins`. Unset, nobody can.
+PROFILE_CLAIM = os.getenv("PROFILE_CLAIM")
+
 # The Application Audience (AUD) tag for your application
 POLICY_AUD = os.getenv("POLICY_AUD")
 
@@ -29,17 +74,27 @@ TEAM_DOMAIN = os.getenv("TEAM_DOMAIN")
 CERTS_URL = "{}/cdn-cgi/access/certs".format(TEAM_DOMAIN)
 
 
+_parsed_keys: Dict[str, jwt.PyJWK] = {}
+
+
+async def _fetch_jwk_set():
+    async with aiohttp.ClientSession() as session:
+        async with session.get(CERTS_URL) as resp:
+            return await resp.json(), JWKS_TTL
+
+
 async def _get_public_keys():
     """
     Returns:
         List of RSA public keys usable by PyJWT.
     """
-    async with aiohttp.ClientSession() as session:
-        async with session.get(CERTS_URL) as resp:
-            jwk_set = await resp.json()
+    jwk_set = await shared_cache.get_or_load(cache, "jwks", _fetch_jwk_set)
     public_keys = []
     for key_dict in jwk_set["keys"]:
-        public_key = jwt.PyJWK.from_json(json.dumps(key_dict))
+        key_json = json.dumps(key_dict, sort_keys=True)
+        public_key = _parsed_keys.get(key_json)
+        if public_key is None:
+            public_key = _parsed_keys[key_json] = jwt.PyJWK.from_json(key_json)
         public_keys.append(public_key)
     return public_keys
 
@@ -79,7 +134,46 @@ async def get_user_token(
     return decoded_token
 
 
-app = FastAPI()
+def _may_profile(user: dict) -> bool:
+    if not PROFILE_CLAIM:
+        return False
+    name, _, wanted = PROFILE_CLAIM.partition("=")
+    value = user.get(name)
+    if isinstance(value, list):
+        return wanted in value
+    return value is not None and str(value) == wanted
+
+
+# Connection pools for the function endpoints, kept for the life of the app.
+transports = Transports.from_env()
+lambda_invoker = LambdaInvokeTransport(aws)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    keep_warm_task = None
+    monitor_task = None
+    if KEEP_WARM_INTERVAL > 0:
+        keep_warm = KeepWarm(
+            _keep_warm_targets,
+            _warm,
+            KEEP_WARM_INTERVAL,
+            KEEP_WARM_BUDGET,
+            claim=lambda: cache.lock("keep_warm", KEEP_WARM_INTERVAL * 0.9),
+            cache=cache,
+        )
+        keep_warm_task = asyncio.create_task(keep_warm.run())
+    if monitor is not None:
+        monitor_task = asyncio.create_task(monitor.run())
+    yield
+    for task in (keep_warm_task, monitor_task):
+        if task is not None:
+            task.cancel()
+    await transports.close()
+    await lambda_invoker.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "*",
@@ -96,115 +190,314 @@ app.add_middleware(
 storage_client = storage.Client()
 bucket = storage_client.bucket(os.getenv("CONFIG_BUCKET"))
 blob = bucket.blob("config.json")
-urls = json.loads(blob.download_as_text())["urls"]
+config = json.loads(blob.download_as_text())
+# Every pinger and how to call it, read once.
+targets = dispatch.load(config)
 
 
 class LatencyResponse(BaseModel):
     provider: str
     region: str
+    # Latency to the target, as measured by the function.
     latency: str
+    # Response format the function answered with, 0 for a legacy pinger.
+    format: int = 0
+    # Phases of the target request, as measured by the function.
+    target_dns_ms: Optional[float] = None
+    target_connect_ms: Optional[float] = None
+    target_tls_ms: Optional[float] = None
+    target_ttfb_ms: Optional[float] = None
+    target_status: Optional[int] = None
+    target_ip: Optional[str] = None
+    error: Optional[str] = None
+    # Time from ping-service to the function and back, and its phases.
+    round_trip_ms: Optional[float] = None
+    dns_ms: Optional[float] = None
+    connect_ms: Optional[float] = None
+    tls_ms: Optional[float] = None
+    ttfb_ms: Optional[float] = None
+    cold_start_suspected: bool = False
+    geography: Optional[str] = None
+
+
+RECORD_FIELDS = list(LatencyResponse.model_fields)
+
+
+def _latency_response(
+    target: dispatch.Target, response: TransportResponse
+) -> LatencyResponse:
+    timings = {
+        name: None if value is None else round(value, 2)
+        for name, value in response.timings.as_dict().items()
+    }
+    result = contract.parse(response.body, response.status)
+    if result.version:
+        latency = "" if result.total_ms is None else f"{result.total_ms:.0f}"
+    else:
+        # Legacy pingers' bodies are passed through as before.
+        latency = response.body.decode(errors="replace")
+    overhead = 0.0
+    if result.total_ms is not None:
+        overhead = timings["round_trip_ms"] - result.total_ms
+    return LatencyResponse(
+        provider=target.provider,
+        region=target.region,
+        geography=target.geography,
+        latency=latency,
+        format=result.version,
+        target_dns_ms=result.dns_ms,
+        target_connect_ms=result.connect_ms,
+        target_tls_ms=result.tls_ms,
+        target_ttfb_ms=result.ttfb_ms,
+        target_status=result.status,
+        target_ip=result.ip,
+        error=result.error,
+        cold_start_suspected=overhead > COLD_START_THRESHOLD_MS,
+        **timings,
+    )
 
 
 async def aws_request(
-    session: aiohttp.ClientSession,
-    uurl: str,
+    transport: Transport,
+    target: dispatch.Target,
     url: str,
-    region: str,
     aws_creds: Credentials,
 ):
     request = awsrequest.AWSRequest(
         method="GET",
-        url=uurl,
+        url=target.url,
         headers={
             "Accept": "application/json",
         },
-        params={"url": url},
+        params={"url": url, **contract.QUERY},
     )
     auth.SigV4Auth(
-        aws_creds, "lambda" if "lambda" in uurl else "execute-api", region
+        aws_creds, target.signing_service, target.signing_region
     ).add_auth(request)
-    response = await session.get(
+    response = await transport.get(
         request.url,
         headers=dict(request.headers.items()),
         params=request.params,
     )
-    return LatencyResponse(provider="aws", region=region, latency=await response.text())
+    return _latency_response(target, response)
+
+
+async def aws_invoke(target: dispatch.Target, url: str, aws_creds: Credentials):
+    response = await lambda_invoker.invoke(
+        target.function_arn,
+        target.signing_region,
+        aws_creds,
+        {"url": url, **contract.QUERY},
+        host=target.host,
+    )
+    return _latency_response(target, response)
+
+
+def _invokes(target: dispatch.Target) -> bool:
+    return target.function_arn is not None and (
+        "*" in AWS_INVOKE_REGIONS or target.region in AWS_INVOKE_REGIONS
+    )
 
 
 async def gcp_request(
-    session: aiohttp.ClientSession, uurl: str, url: str, region: str, id_token: str
+    transport: Transport, target: dispatch.Target, url: str, id_token: str
 ):
-    response = await session.get(
-        f"{uurl}?url={url}",
+    response = await transport.get(
+        target.url,
         headers={
             "Accept": "application/json",
             "Authorization": f"Bearer {id_token}",
         },
+        params={"url": url, **contract.QUERY},
     )
-    return LatencyResponse(provider="gcp", region=region, latency=await response.text())
+    return _latency_response(target, response)
 
 
-async def azure_request(
-    session: aiohttp.ClientSession, uurl: str, url: str, region: str
-):
-    response = await session.get(f"{uurl}?url={url}")
-    return LatencyResponse(
-        provider="azure", region=region, latency=await response.text()
+async def anonymous_request(transport: Transport, target: dispatch.Target, url: str):
+    response = await transport.get(target.url, params={"url": url, **contract.QUERY})
+    return _latency_response(target, response)
+
+
+async def _get_id_token(audience: str) -> str:
+    async def load():
+        request = google.auth.transport._aiohttp_requests.Request()
+        token = await google.oauth2._id_token_async.fetch_id_token(request, audience)
+        expires = jwt.decode(token, options={"verify_signature": False})["exp"]
+        return token, expires - time.time() - EXPIRY_MARGIN
+
+    return await shared_cache.get_or_load(cache, f"id_token:{audience}", load)
+
+
+async def _get_aws_credentials() -> Credentials:
+    async def load():
+        aws_id_token = await _get_id_token("sts.amazonaws.com")
+        async with aws.client("sts") as client:
+            sts_token = await client.assume_role_with_web_identity(
+                RoleArn="arn:aws:iam::596309961293:role/ping-service-role",
+                RoleSessionName="ping-service-session",
+                WebIdentityToken=aws_id_token,
+            )
+        creds = sts_token["Credentials"]
+        expires = creds["Expiration"] - datetime.datetime.now(datetime.timezone.utc)
+        return {
+            "access_key": creds["AccessKeyId"],
+            "secret_key": creds["SecretAccessKey"],
+            "token": creds["SessionToken"],
+        }, expires.total_seconds() - EXPIRY_MARGIN
+
+    return Credentials(
+        **await shared_cache.get_or_load(cache, "aws_credentials", load)
     )
 
 
-async def alibaba_request(
-    session: aiohttp.ClientSession, uurl: str, url: str, region: str
+def _ping(
+    provider: str,
+    region: str,
+    url: str,
+    id_token: str,
+    aws_creds: Credentials,
 ):
-    response = await session.get(f"{uurl}?url={url}")
-    return LatencyResponse(
-        provider="alicloud", region=region, latency=await response.text()
+    target = targets[provider, region]
+    transport = transports[provider]
+    if target.auth == dispatch.ID_TOKEN:
+        return gcp_request(transport, target, url, id_token)
+    if target.auth == dispatch.SIGV4:
+        if _invokes(target):
+            return aws_invoke(target, url, aws_creds)
+        return aws_request(transport, target, url, aws_creds)
+    return anonymous_request(transport, target, url)
+
+
+def _keep_warm_targets():
+    return [(target.provider, target.region) for target in targets]
+
+
+async def _warm(targets):
+    id_token = await _get_id_token("pinger")
+    aws_creds = await _get_aws_credentials()
+    await asyncio.gather(
+        *(
+            _ping(provider, region, KEEP_WARM_URL, id_token, aws_creds)
+            for provider, region in targets
+        ),
+        return_exceptions=True,
     )
 
 
+async def _monitor_sample(
+    provider: str, region: str, url: str, id_token: str, aws_creds: Credentials
+):
+    try:
+        result = await _ping(provider, region, url, id_token, aws_creds)
+    except Exception:
+        return provider, region, None
+    try:
+        latency = None if result.error else float(result.latency)
+    except ValueError:
+        latency = None
+    return provider, region, latency
+
+
+async def _monitor_round(url: str):
+    id_token = await _get_id_token("pinger")
+    aws_creds = await _get_aws_credentials()
+    tasks = [
+        asyncio.create_task(
+            _monitor_sample(provider, region, url, id_token, aws_creds)
+        )
+        for provider, region in _keep_warm_targets()
+    ]
+    for task in asyncio.as_completed(tasks):
+        yield await task
+
+
+monitor = Monitor.from_config(cache, _monitor_round, config.get("monitor", {}))
+
+
 async def pinger_streamer(url: str):
-    request = google.auth.transport._aiohttp_requests.Request()
-    id_token = await google.oauth2._id_token_async.fetch_id_token(request, "pinger")
-    aws_id_token = await google.oauth2._id_token_async.fetch_id_token(
-        request, "sts.amazonaws.com"
-    )
-    async with aws.client("sts") as client:
-        sts_token = await client.assume_role_with_web_identity(
-            RoleArn="arn:aws:iam::596309961293:role/ping-service-role",
-            RoleSessionName="ping-service-session",
-            WebIdentityToken=aws_id_token,
+    result_key = f"results:{url}"
+    if RESULT_CACHE_TTL > 0:
+        cached = await cache.get(result_key)
+        if cached is not None:
+            for record in cached:
+                yield record
+            return
+    id_token = await _get_id_token("pinger")
+    aws_creds = await _get_aws_credentials()
+    records = []
+    tasks: List[asyncio.Future[LatencyResponse]] = []
+    for target in targets:
+        task = asyncio.create_task(
+            _ping(target.provider, target.region, url, id_token, aws_creds)
         )
-    aws_creds = Credentials(
-        access_key=sts_token["Credentials"]["AccessKeyId"],
-        secret_key=sts_token["Credentials"]["SecretAccessKey"],
-        token=sts_token["Credentials"]["SessionToken"],
+        tasks.append(task)
+
+    for task in asyncio.as_completed(tasks):
+        record = (await task).model_dump()
+        records.append(record)
+        yield record
+    if RESULT_CACHE_TTL > 0:
+        await cache.set(result_key, records, RESULT_CACHE_TTL)
+
+
+async def _profiled(url: str, encoder) -> Response:
+    size = 0
+    async with profiling.Profile() as profile:
+        async for chunk in streaming.encode(pinger_streamer(url), encoder):
+            size += len(chunk)
+    artifact = profile.artifact(url=url, media_type=encoder.media_type, bytes=size)
+    filename = time.strftime("profile-%Y%m%dT%H%M%SZ.json", time.gmtime())
+    return Response(
+        json.dumps(artifact),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
-    async with aiohttp.ClientSession() as session:
-        tasks: List[asyncio.Future[LatencyResponse]] = []
-        for region, uurl in urls["faas.gcp"].items():
-            task = asyncio.create_task(
-                gcp_request(session, uurl, url, region, id_token)
-            )
-            tasks.append(task)
-        for region, uurl in urls["faas.aws"].items():
-            task = asyncio.create_task(
-                aws_request(session, uurl, url, region, aws_creds)
-            )
-            tasks.append(task)
-        for region, uurl in urls["faas.azure"].items():
-            task = asyncio.create_task(azure_request(session, uurl, url, region))
-            tasks.append(task)
-        for region, uurl in urls["faas.alicloud"].items():
-            task = asyncio.create_task(alibaba_request(session, uurl, url, region))
-            tasks.append(task)
-
-        for task in asyncio.as_completed(tasks):
-            yield (await task).model_dump_json() + "\n"
 
 
 @app.get("/")
-async def root(url: str, user=Depends(get_user_token)):
-    return StreamingResponse(pinger_streamer(url), media_type="application/x-ndjson")
+async def root(
+    url: str,
+    request: Request,
+    profile: bool = False,
+    user=Depends(get_user_token),
+):
+    """
+    Streams one record per region in the format picked by the Accept header
+    (NDJSON, CSV or MessagePack), compressed when Accept-Encoding allows.
+
+    With `profile=true`, admins get a profile of the request instead.
+    """
+    encoder = streaming.negotiate_encoder(request.headers.get("accept"))
+    if profile:
+        if not _may_profile(user):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Profiling needs an admin token",
+            )
+        return await _profiled(url, encoder(RECORD_FIELDS))
+    body = streaming.coalesce(
+        streaming.encode(pinger_streamer(url), encoder(RECORD_FIELDS)),
+        STREAM_FLUSH_MS / 1000,
+        STREAM_FLUSH_RECORDS,
+    )
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    compressor = streaming.negotiate_compressor(
+        request.headers.get("accept-encoding")
+    )
+    if compressor is not None:
+        body = streaming.compress(body, compressor())
+        headers["Content-Encoding"] = compressor.encoding
+    return StreamingResponse(body, media_type=encoder.media_type, headers=headers)
+
+
+@app.get("/monitor")
+async def monitor_stats(user=Depends(get_user_token)):
+    if monitor is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No monitor targets configured",
+        )
+    return await monitor.snapshot()
 
 
 @app.get("/liveness_check")
@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from array import array
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Percentiles come from a log-bucketed histogram; each bucket spans 4%, so
+# reported percentiles are within about 2% of the exact value.
+_GAMMA = 1.04
+_LOG_GAMMA = math.log(_GAMMA)
+_MIN_MS = 0.01
+_MAX_MS = 600_000.0
+_BUCKETS = int(math.log(_MAX_MS / _MIN_MS) / _LOG_GAMMA) + 2
+
+PERCENTILES = (50, 90, 99)
+
+
+def _bucket(value: float) -> int:
+    if value <= _MIN_MS:
+        return 0
+    return min(_BUCKETS - 1, int(math.log(value / _MIN_MS) / _LOG_GAMMA) + 1)
+
+
+def _bucket_value(index: int) -> float:
+    if index == 0:
+        return _MIN_MS
+    # Geometric middle of the bucket.
+    return _MIN_MS * _GAMMA ** (index - 0.5)
+
+
+class RollingWindow:
+    """
+    The last `size` samples for one (target, region), in a ring buffer.
+
+    Count, sum, min, max and a percentile histogram are updated as samples
+    enter and leave, so reading the aggregates doesn't scan the samples.
+    Failed pings are stored as NaN and only counted.
+    """
+
+    __slots__ = (
+        "size",
+        "samples",
+        "histogram",
+        "head",
+        "filled",
+        "count",
+        "failures",
+        "total",
+        "min",
+        "max",
+        "last",
+        "updated",
+    )
+
+    def __init__(self, size: int):
+        self.size = size
+        self.samples = array("d", [math.nan]) * size
+        self.histogram = array("I", [0]) * _BUCKETS
+        self.head = 0
+        self.filled = 0
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = math.nan
+        self.updated = 0.0
+
+    def add(self, value: Optional[float]):
+        value = math.nan if value is None else float(value)
+        rescan = False
+        if self.filled == self.size:
+            old = self.samples[self.head]
+            if math.isnan(old):
+                self.failures -= 1
+            else:
+                self.count -= 1
+                self.total -= old
+                self.histogram[_bucket(old)] -= 1
+                rescan = old <= self.min or old >= self.max
+        else:
+            self.filled += 1
+        self.samples[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.last = value
+        self.updated = time.time()
+        if math.isnan(value):
+            self.failures += 1
+        else:
+            self.count += 1
+            self.total += value
+            self.histogram[_bucket(value)] += 1
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        if rescan:
+            # The evicted sample was an extreme; only then is a scan needed.
+            present = [v for v in self.samples if not math.isnan(v)]
+            self.min = min(present, default=math.inf)
+            self.max = max(present, default=-math.inf)
+
+    def values(self) -> List[Optional[float]]:
+        """The samples, oldest first, with None for failures."""
+        start = (self.head - self.filled) % self.size
+        ordered = (self.samples[(start + i) % self.size] for i in range(self.filled))
+        return [None if math.isnan(v) else v for v in ordered]
+
+    @classmethod
+    def restore(
+        cls, size: int, values: Iterable[Optional[float]], updated: float
+    ) -> "RollingWindow":
+        """A window holding `values`, as returned by `values()`."""
+        window = cls(size)
+        for value in values:
+            window.add(value)
+        window.updated = updated
+        return window
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        if rank == self.count:
+            return self.max
+        seen = 0
+        for index, bucket_count in enumerate(self.histogram):
+            seen += bucket_count
+            if seen >= rank:
+                return min(max(_bucket_value(index), self.min), self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        stats = {
+            "mean_ms": self.total / self.count if self.count else None,
+            "min_ms": self.min if self.count else None,
+            "max_ms": self.max if self.count else None,
+            "last_ms": None if math.isnan(self.last) else self.last,
+        }
+        for pct in PERCENTILES:
+            stats[f"p{pct}_ms"] = self.percentile(pct)
+        return {
+            "samples": self.count,
+            "failures": self.failures,
+            "updated": self.updated,
+            **{
+                name: None if value is None else round(value, 2)
+                for name, value in stats.items()
+            },
+        }
+
+
+# (provider, region, latency in ms or None for a failure)
+Sample = Tuple[str, str, Optional[float]]
+
+
+class Monitor:
+    """
+    Pings a fixed set of targets from every region every `interval` seconds
+    (give or take `jitter` as a fraction of it) and keeps rolling aggregates
+    of the last `window` results per (target, region) in memory.
+
+    With several workers only the one holding the leader lease in the cache
+    runs rounds; it publishes its snapshot to the cache for the others, along
+    with the samples themselves so a worker that takes over carries on from
+    the same history.
+    """
+
+    def __init__(
+        self,
+        cache,
+        ping_round: Callable[[str], AsyncIterator[Sample]],
+        targets: Iterable[str],
+        interval: float = 60.0,
+        jitter: float = 0.1,
+        window: int = 60,
+    ):
+        self.cache = cache
+        self.ping_round = ping_round
+        self.targets = list(targets)
+        self.interval = interval
+        self.jitter = jitter
+        self.window = window
+        self.windows: Dict[str, Dict[str, RollingWindow]] = {
+            target: {} for target in self.targets
+        }
+        self.worker_id = f"{os.getpid()}-{random.getrandbits(32):08x}"
+        self.leading = False
+        # When this worker's windows were last brought up to date.
+        self.updated = 0.0
+
+    @classmethod
+    def from_config(cls, cache, ping_round, config: dict) -> Optional["Monitor"]:
+        """
+        Builds a monitor from the `monitor` section of `config.json`:
+        `{"targets": [...], "interval": 60, "jitter": 0.1, "window": 60}`.
+        """
+        if not config.get("targets"):
+            return None
+        return cls(
+            cache,
+            ping_round,
+            config["targets"],
+            interval=float(config.get("interval", 60)),
+            jitter=float(config.get("jitter", 0.1)),
+            window=int(config.get("window", 60)),
+        )
+
+    async def _is_leader(self) -> bool:
+        lease = self.interval * 3
+        leader = await self.cache.get("monitor:leader")
+        if leader is None and await self.cache.lock("monitor:leader", lease):
+            leader = self.worker_id
+        if leader != self.worker_id:
+            return False
+        await self.cache.set("monitor:leader", self.worker_id, lease)
+        return True
+
+    async def _restore(self):
+        """Takes over the published samples if they're newer than ours."""
+        state = await self.cache.get("monitor:state")
+        if state is None or state["updated"] <= self.updated:
+            return
+        self.windows = {
+            target: {
+                key: RollingWindow.restore(self.window, saved["values"], saved["updated"])
+                for key, saved in state["windows"].get(target, {}).items()
+            }
+            for target in self.targets
+        }
+        self.updated = state["updated"]
+
+    async def round(self):
+        for target in self.targets:
+            windows = self.windows[target]
+            async for provider, region, latency in self.ping_round(target):
+                key = f"{provider}/{region}"
+                window = windows.get(key)
+                if window is None:
+                    window = windows[key] = RollingWindow(self.window)
+                window.add(latency)
+        self.updated = time.time()
+        await self.cache.set("monitor:snapshot", self.local_snapshot(), self.interval * 3)
+        state = {
+            "updated": self.updated,
+            "windows": {
+                target: {
+                    key: {"values": window.values(), "updated": window.updated}
+                    for key, window in windows.items()
+                }
+                for target, windows in self.windows.items()
+            },
+        }
+        # Kept for as long as the history covers.
+        await self.cache.set(
+            "monitor:state", state, self.interval * max(3, self.window)
+        )
+
+    def _snapshot(self, windows: Dict[str, Dict[str, RollingWindow]]) -> dict:
+        return {
+            "interval": self.interval,
+            "window": self.window,
+            "targets": {
+                target: {key: window.snapshot() for key, window in regions.items()}
+                for target, regions in windows.items()
+            },
+        }
+
+    def local_snapshot(self) -> dict:
+        return self._snapshot(self.windows)
+
+    async def snapshot(self) -> dict:
+        if self.leading:
+            return self.local_snapshot()
+        # Another worker leads; whatever this one holds may be stale.
+        shared = await self.cache.get("monitor:snapshot")
+        if shared is not None:
+            return shared
+        return self._snapshot({target: {} for target in self.targets})
+
+    async def tick(self):
+        """One scheduled round: runs it if this worker holds the lease."""
+        leading = await self._is_leader()
+        if leading and not self.leading:
+            await self._restore()
+        self.leading = leading
+        if leading:
+            await self.round()
+
+    async def run(self):
+        while True:
+            spread = self.interval * self.jitter
+            await asyncio.sleep(max(0.0, self.interval + random.uniform(-spread, spread)))
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("monitor round failed")
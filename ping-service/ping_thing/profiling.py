@@ -0,0 +1,140 @@
+"""
+Profiling of a single request, for admins chasing one slow request.
+
+Nothing here runs unless a request asks for it.
+"""
+
+import asyncio
+import collections
+import math
+import sys
+import threading
+import time
+from array import array
+from typing import Counter, Dict, Optional
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread (the event loop's) from a background
+    thread every `interval` seconds, counting identical stacks.
+
+    Stacks are kept in the folded format (`outer;inner;leaf`), which
+    flamegraph.pl, speedscope and friends read directly.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter[str] = collections.Counter()
+        self.samples = 0
+        self._thread_id = threading.get_ident()
+        self._stopping = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _fold(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _sample(self):
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[self._fold(frame)] += 1
+                self.samples += 1
+
+    def start(self):
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+class LoopLag:
+    """
+    Measures how late the event loop wakes a task that sleeps `interval`
+    seconds at a time; the overshoot is time the loop spent busy elsewhere.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = array("d")
+        self._task: Optional[asyncio.Task] = None
+
+    async def _measure(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(
+                max(0.0, time.perf_counter() - start - self.interval) * 1000
+            )
+
+    def start(self):
+        self._task = asyncio.create_task(self._measure())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        if not self.lags:
+            return {"samples": 0, "mean_ms": None, "p99_ms": None, "max_ms": None}
+        ordered = sorted(self.lags)
+        return {
+            "samples": len(ordered),
+            "mean_ms": round(sum(ordered) / len(ordered), 3),
+            "p99_ms": round(ordered[math.ceil(0.99 * len(ordered)) - 1], 3),
+            "max_ms": round(ordered[-1], 3),
+        }
+
+
+class Profile:
+    """
+    Runs a SamplingProfiler and a LoopLag together around one request:
+
+        async with Profile() as profile:
+            ...
+        artifact = profile.artifact()
+
+    The profiler sees the whole event loop, so anything else the worker was
+    doing at the same time shows up as well.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.profiler = SamplingProfiler(interval)
+        self.lag = LoopLag()
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    async def __aenter__(self) -> "Profile":
+        self.started = time.perf_counter()
+        self.profiler.start()
+        self.lag.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.lag.stop()
+        self.profiler.stop()
+        self.elapsed = time.perf_counter() - self.started
+
+    def artifact(self, **details) -> dict:
+        return {
+            **details,
+            "duration_ms": round(self.elapsed * 1000, 3),
+            "interval_ms": self.profiler.interval * 1000,
+            "samples": self.profiler.samples,
+            "loop_lag": self.lag.summary(),
+            "folded_stacks": self.profiler.folded(),
+        }
@@ -0,0 +1,56 @@
+"""
+Entrypoint for running ping-service with one or more uvicorn workers.
+
+`WORKERS` (default 1) sets the number of worker processes. With more than one
+worker a `CacheServer` is started alongside them so tokens, credentials, keys
+and results are fetched once and shared rather than once per worker.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+import uvicorn
+
+from ping_thing.shared_cache import CacheServer
+
+
+def _run_cache_server(path: str):
+    asyncio.run(CacheServer(path).serve_forever())
+
+
+def main():
+    workers = int(os.getenv("WORKERS", "1"))
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8080"))
+
+    cache_server = None
+    if workers > 1 and not os.getenv("SHARED_CACHE_SOCKET"):
+        path = os.path.join(tempfile.mkdtemp(prefix="ping-service-"), "cache.sock")
+        cache_server = multiprocessing.Process(
+            target=_run_cache_server, args=(path,), daemon=True
+        )
+        cache_server.start()
+        deadline = time.monotonic() + 10
+        while not os.path.exists(path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Workers are spawned by uvicorn and inherit this environment.
+        os.environ["SHARED_CACHE_SOCKET"] = path
+
+    try:
+        uvicorn.run(
+            "ping_thing.main:app",
+            host=host,
+            port=port,
+            workers=workers,
+            access_log=os.getenv("ACCESS_LOG", "1") != "0",
+        )
+    finally:
+        if cache_server is not None:
+            cache_server.terminate()
+
+
+if __name__ == "__main__":
+    main()
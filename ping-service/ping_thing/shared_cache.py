@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# How long a worker waits for another worker to fill a key it holds the lock
+# for before giving up and loading the value itself.
+LOCK_TTL = 10.0
+POLL_INTERVAL = 0.05
+
+
+class LocalCache:
+    """
+    In-process TTL cache, used when the service runs as a single worker.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[float, Any]] = {}
+        self._locks: Dict[str, float] = {}
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self._values[key] = (time.monotonic() + ttl, value)
+
+    async def lock(self, key: str, ttl: float = LOCK_TTL) -> bool:
+        now = time.monotonic()
+        if self._locks.get(key, 0) > now:
+            return False
+        self._locks[key] = now + ttl
+        return True
+
+    async def unlock(self, key: str):
+        self._locks.pop(key, None)
+
+
+class CacheServer(LocalCache):
+    """
+    Serves a `LocalCache` to the other workers over a Unix socket.
+
+    The protocol is one JSON object per line in each direction, e.g.
+    `{"op": "get", "key": "jwks"}` answered by `{"value": ...}`.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                op = request["op"]
+                if op == "get":
+                    response = {"value": await self.get(request["key"])}
+                elif op == "set":
+                    await self.set(request["key"], request["value"], request["ttl"])
+                    response = {"ok": True}
+                elif op == "lock":
+                    response = {"ok": await self.lock(request["key"], request["ttl"])}
+                elif op == "unlock":
+                    await self.unlock(request["key"])
+                    response = {"ok": True}
+                else:
+                    response = {"error": f"unknown op {op}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError, KeyError):
+            pass
+        finally:
+            writer.close()
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for key, (expires, _) in list(self._values.items()):
+                if expires < now:
+                    del self._values[key]
+
+    async def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        sweeper = asyncio.create_task(self._sweep())
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                sweeper.cancel()
+
+
+class SharedCache:
+    """
+    Client for a `CacheServer`, one per worker process.
+
+    Requests are small and answered from memory, so a single connection with
+    requests serialised through a lock is enough.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = asyncio.Lock()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    async def _call(self, **request) -> dict:
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        self._reader, self._writer = await asyncio.open_unix_connection(
+                            self.path
+                        )
+                    self._writer.write(json.dumps(request).encode() + b"\n")
+                    await self._writer.drain()
+                    line = await self._reader.readline()
+                    if not line:
+                        raise ConnectionResetError("cache server closed connection")
+                    return json.loads(line)
+                except (ConnectionError, FileNotFoundError):
+                    self._writer = None
+                    if attempt:
+                        raise
+
+    async def get(self, key: str) -> Optional[Any]:
+        return (await self._call(op="get", key=key))["value"]
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._call(op="set", key=key, value=value, ttl=ttl)
+
+    async def lock(self, key: str, ttl: float = LOCK_TTL) -> bool:
+        return (await self._call(op="lock", key=key, ttl=ttl))["ok"]
+
+    async def unlock(self, key: str):
+        await self._call(op="unlock", key=key)
+
+
+def from_env():
+    """The shared cache if `SHARED_CACHE_SOCKET` is set, otherwise a local one."""
+    path = os.getenv("SHARED_CACHE_SOCKET")
+    if path:
+        return SharedCache(path)
+    return LocalCache()
+
+
+async def get_or_load(
+    cache,
+    key: str,
+    loader: Callable[[], Awaitable[Tuple[Any, float]]],
+):
+    """
+    Returns the cached value for `key`, calling `loader` on a miss.
+
+    `loader` returns the value and its TTL in seconds. Only one worker loads a
+    given key at a time; the others wait for it to show up in the cache so
+    adding workers doesn't multiply calls to upstream services.
+    """
+    value = await cache.get(key)
+    if value is not None:
+        return value
+    deadline = time.monotonic() + LOCK_TTL
+    locked = await cache.lock(key)
+    while not locked and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        value = await cache.get(key)
+        if value is not None:
+            return value
+        locked = await cache.lock(key)
+    try:
+        value = await cache.get(key)
+        if value is None:
+            value, ttl = await loader()
+            if ttl > 0:
+                await cache.set(key, value, ttl)
+        return value
+    finally:
+        if locked:
+            await cache.unlock(key)
@@ -0,0 +1,257 @@
+import asyncio
+import csv
+import io
+import json
+import zlib
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import msgpack
+
+try:
+    # Python 3.14+
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+Chunk = TypeVar("Chunk", str, bytes)
+
+
+async def coalesce(
+    chunks: AsyncIterator[Chunk], window: float, max_records: int
+) -> AsyncIterator[Chunk]:
+    """
+    Joins chunks that arrive close together into fewer, larger writes.
+
+    The first chunk is passed on at once so time to first byte is unchanged.
+    After that, a chunk waits at most `window` seconds for others to join it,
+    and a batch is flushed as soon as it holds `max_records` chunks.
+    """
+    if window <= 0 or max_records <= 1:
+        async for chunk in chunks:
+            yield chunk
+        return
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    pending: List[Chunk] = []
+    deadline = 0.0
+    first = True
+    next_chunk: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if pending else None
+            done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+            if not done:
+                yield pending[0][:0].join(pending)
+                pending = []
+                continue
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                next_chunk = None
+            if first:
+                first = False
+                yield chunk
+                continue
+            if not pending:
+                deadline = loop.time() + window
+            pending.append(chunk)
+            if len(pending) >= max_records:
+                yield pending[0][:0].join(pending)
+                pending = []
+        if pending:
+            yield pending[0][:0].join(pending)
+    finally:
+        if next_chunk is not None:
+            next_chunk.cancel()
+
+
+Record = Dict[str, object]
+
+
+class NdjsonEncoder:
+    media_type = "application/x-ndjson"
+
+    def __init__(self, fields: Sequence[str]):
+        pass
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, record: Record) -> bytes:
+        return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+class CsvEncoder:
+    """One row per record, after a header row naming `fields`."""
+
+    media_type = "text/csv"
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = fields
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+
+    def _row(self, values: Iterable[object]) -> bytes:
+        self._writer.writerow(values)
+        row = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return row
+
+    def header(self) -> bytes:
+        return self._row(self.fields)
+
+    @staticmethod
+    def _cell(value: object) -> object:
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return value
+
+    def encode(self, record: Record) -> bytes:
+        return self._row(self._cell(record.get(field)) for field in self.fields)
+
+
+class MsgpackEncoder:
+    """A stream of MessagePack maps, one per record, with no framing between."""
+
+    media_type = "application/x-msgpack"
+
+    def __init__(self, fields: Sequence[str]):
+        self._packer = msgpack.Packer()
+
+    def header(self) -> bytes:
+        return b""
+
+    def encode(self, record: Record) -> bytes:
+        return self._packer.pack(record)
+
+
+ENCODERS = {
+    "application/x-ndjson": NdjsonEncoder,
+    "text/csv": CsvEncoder,
+    "application/x-msgpack": MsgpackEncoder,
+    "application/msgpack": MsgpackEncoder,
+    "application/vnd.msgpack": MsgpackEncoder,
+}
+
+
+class GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        # A sync flush per write keeps every record decodable on arrival.
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class ZstdCompressor:
+    encoding = "zstd"
+
+    def __init__(self):
+        self._compressor = zstd.ZstdCompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data, zstd.ZstdCompressor.FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+COMPRESSORS: Dict[str, Callable] = {"gzip": GzipCompressor}
+if zstd is not None:
+    COMPRESSORS["zstd"] = ZstdCompressor
+
+
+def _preferences(header: str) -> List[Tuple[float, int, str]]:
+    """
+    Parses an Accept or Accept-Encoding header into (quality, position, value),
+    best first, leaving out anything with q=0.
+    """
+    preferences = []
+    for position, item in enumerate(header.split(",")):
+        value, *params = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if value and quality > 0:
+            preferences.append((-quality, position, value.lower()))
+    preferences.sort()
+    return preferences
+
+
+def negotiate_encoder(accept: Optional[str]) -> Callable:
+    """
+    The encoder for the best media type in `accept` that is supported, or
+    NDJSON, which is what clients got before formats could be picked
+    (including those asking for `application/json`).
+    """
+    for _, _, media_type in _preferences(accept or ""):
+        if media_type in ENCODERS:
+            return ENCODERS[media_type]
+    return NdjsonEncoder
+
+
+def negotiate_compressor(accept_encoding: Optional[str]) -> Optional[Callable]:
+    """
+    The compressor for the best encoding in `accept_encoding`, zstd winning
+    ties, or None to send the stream uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    ranked = sorted(
+        _preferences(accept_encoding), key=lambda p: (p[0], p[2] != "zstd", p[1])
+    )
+    for _, _, encoding in ranked:
+        if encoding in COMPRESSORS:
+            return COMPRESSORS[encoding]
+        if encoding == "identity":
+            return None
+    return None
+
+
+async def encode(records: AsyncIterator[Record], encoder) -> AsyncIterator[bytes]:
+    # The header goes out with the first record rather than on its own.
+    header = encoder.header()
+    async for record in records:
+        yield header + encoder.encode(record)
+        break
+    else:
+        if header:
+            yield header
+        return
+    async for record in records:
+        yield encoder.encode(record)
+
+
+async def compress(chunks: AsyncIterator[bytes], compressor) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield compressor.compress(chunk)
+    yield compressor.finish()
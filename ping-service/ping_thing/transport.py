@@ -0,0 +1,394 @@
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from contextlib import AsyncExitStack
+from typing import Dict, NamedTuple, Optional, Set, Union
+from urllib.parse import urlencode, urlsplit
+
+import aioboto3
+import aiohttp
+import httpx
+from botocore.credentials import Credentials
+
+PROVIDERS = ("gcp", "aws", "azure", "alicloud")
+
+
+class Timings:
+    """
+    Phases of one request as seen by ping-service, in milliseconds.
+
+    Phases that didn't happen, such as DNS and connecting on a reused
+    connection, are None. Time spent waiting for a free connection in the
+    pool isn't part of any phase, so the clock starts once the wait is over.
+    """
+
+    __slots__ = ("marks", "start")
+
+    def __init__(self):
+        self.marks: Dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def mark(self, name: str):
+        self.marks[name] = time.perf_counter()
+
+    @property
+    def begin(self) -> float:
+        return self.marks.get("queued_end", self.start)
+
+    def _between(self, first: str, last: str) -> Optional[float]:
+        if first in self.marks and last in self.marks:
+            return (self.marks[last] - self.marks[first]) * 1000
+        return None
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        dns = self._between("dns_start", "dns_end")
+        connect = self._between("connect_start", "connect_end")
+        if connect is not None and dns is not None:
+            connect -= dns
+        ready = self.marks.get("tls_end", self.marks.get("connect_end", self.begin))
+        headers = self.marks.get("headers")
+        return {
+            "dns_ms": dns,
+            "connect_ms": connect,
+            "tls_ms": self._between("tls_start", "tls_end"),
+            "ttfb_ms": (headers - ready) * 1000 if headers is not None else None,
+            "round_trip_ms": self.total_ms,
+        }
+
+    @property
+    def total_ms(self) -> float:
+        return (self.marks.get("end", time.perf_counter()) - self.begin) * 1000
+
+
+class Response(NamedTuple):
+    status: int
+    body: bytes
+    http_version: str
+    timings: Timings
+
+
+def _aiohttp_trace_config() -> aiohttp.TraceConfig:
+    def mark(name: str):
+        async def hook(session, context, params):
+            if context.trace_request_ctx is not None:
+                context.trace_request_ctx.mark(name)
+
+        return hook
+
+    config = aiohttp.TraceConfig()
+    config.on_connection_queued_end.append(mark("queued_end"))
+    config.on_dns_resolvehost_start.append(mark("dns_start"))
+    config.on_dns_resolvehost_end.append(mark("dns_end"))
+    # aiohttp opens the socket and does the TLS handshake in one step, so
+    # connect_ms includes TLS and tls_ms stays empty.
+    config.on_connection_create_start.append(mark("connect_start"))
+    config.on_connection_create_end.append(mark("connect_end"))
+    config.on_request_end.append(mark("headers"))
+    return config
+
+
+class Http1Transport:
+    """
+    aiohttp client. Connections are kept alive and reused, but each in-flight
+    request to a host needs a connection of its own.
+
+    The pool has no overall cap: there is a pinger per region and concurrent
+    streams share the pool, so a cap would queue pings behind each other.
+    """
+
+    name = "http1"
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created on first use so it binds to the running event loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0),
+                trace_configs=[_aiohttp_trace_config()],
+            )
+        return self._session
+
+    async def get(self, url: str, headers=None, params=None) -> Response:
+        timings = Timings()
+        async with self.session.get(
+            url, headers=headers, params=params, trace_request_ctx=timings
+        ) as response:
+            body = await response.read()
+        timings.mark("end")
+        return Response(response.status, body, "HTTP/1.1", timings)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+# httpcore trace events and the phase marks they correspond to. httpcore
+# resolves the host inside connect_tcp without an event of its own, so
+# connect_ms includes DNS and dns_ms stays empty.
+_HTTPX_EVENTS = {
+    "connection.connect_tcp.started": "connect_start",
+    "connection.connect_tcp.complete": "connect_end",
+    "connection.start_tls.started": "tls_start",
+    "connection.start_tls.complete": "tls_end",
+    "http11.receive_response_headers.complete": "headers",
+    "http2.receive_response_headers.complete": "headers",
+}
+
+
+class Http2Transport:
+    """
+    httpx client with HTTP/2 enabled, multiplexing concurrent requests to the
+    same host over a single connection.
+
+    Hosts that don't negotiate HTTP/2, or fail with a protocol error, are
+    remembered and sent through `fallback` from then on.
+    """
+
+    name = "http2"
+
+    def __init__(self, fallback: Http1Transport):
+        self.fallback = fallback
+        self.http1_hosts: Set[str] = set()
+        # Uncapped for the same reason as Http1Transport.
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(300.0),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None),
+        )
+
+    async def get(self, url: str, headers=None, params=None) -> Response:
+        host = urlsplit(url).netloc
+        if host in self.http1_hosts:
+            return await self.fallback.get(url, headers=headers, params=params)
+        timings = Timings()
+
+        async def trace(event: str, info: dict):
+            name = _HTTPX_EVENTS.get(event)
+            if name is not None:
+                timings.mark(name)
+
+        try:
+            response = await self._client.get(
+                url, headers=headers, params=params, extensions={"trace": trace}
+            )
+        except httpx.RemoteProtocolError:
+            self.http1_hosts.add(host)
+            return await self.fallback.get(url, headers=headers, params=params)
+        timings.mark("end")
+        if response.http_version != "HTTP/2":
+            self.http1_hosts.add(host)
+        return Response(
+            response.status_code, response.content, response.http_version, timings
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+
+Transport = Union[Http1Transport, Http2Transport]
+
+
+def _function_url_event(host: str, params: Dict[str, str]) -> dict:
+    """
+    A `GET /` in the shape a Lambda function URL hands to the function
+    (API Gateway payload format 2.0), which the web adapter turns back into an
+    HTTP request for the pinger.
+    """
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": "/",
+        "rawQueryString": urlencode(params),
+        "queryStringParameters": params,
+        "headers": {"host": host, "accept": "*/*", "user-agent": "ping-service"},
+        "requestContext": {
+            "accountId": "anonymous",
+            "apiId": host.split(".", 1)[0],
+            "domainName": host,
+            "domainPrefix": host.split(".", 1)[0],
+            "http": {
+                "method": "GET",
+                "path": "/",
+                "protocol": "HTTP/1.1",
+                "sourceIp": "127.0.0.1",
+                "userAgent": "ping-service",
+            },
+            "requestId": str(uuid.uuid4()),
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+        },
+        "isBase64Encoded": False,
+    }
+
+
+class _LambdaClient:
+    """A Lambda client and the number of invokes still using it."""
+
+    __slots__ = ("rank", "client", "stack", "in_flight")
+
+    def __init__(self, rank: int, client, stack: AsyncExitStack):
+        self.rank = rank
+        self.client = client
+        self.stack = stack
+        self.in_flight = 0
+
+
+class LambdaInvokeTransport:
+    """
+    Calls the AWS pingers through the Lambda Invoke API instead of their
+    function URL or API Gateway, so no gateway sits in the measured path.
+
+    Keeps one Lambda client per region, rebuilt when newer credentials turn
+    up. Invokes still holding older credentials use the newer client rather
+    than bringing an old one back. A replaced client is closed once the
+    invokes still using it finish.
+    """
+
+    name = "invoke"
+    # How many access keys to remember the order of. Credentials rotate
+    # hourly, so this covers invokes holding keys far older than any will.
+    KEYS_KEPT = 16
+
+    def __init__(self, session: aioboto3.Session):
+        self.session = session
+        self._clients: Dict[str, _LambdaClient] = {}
+        # Replaced clients with invokes still running.
+        self._retired: Set[_LambdaClient] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Access key -> the order it was first seen in.
+        self._ranks: Dict[str, int] = {}
+        self._seen = 0
+
+    def _rank(self, access_key: str) -> int:
+        rank = self._ranks.get(access_key)
+        if rank is None:
+            self._seen += 1
+            rank = self._ranks[access_key] = self._seen
+            if len(self._ranks) > self.KEYS_KEPT:
+                del self._ranks[next(iter(self._ranks))]
+        return rank
+
+    async def _acquire(self, region: str, creds: Credentials) -> _LambdaClient:
+        replaced = None
+        async with self._locks.setdefault(region, asyncio.Lock()):
+            rank = self._rank(creds.access_key)
+            entry = self._clients.get(region)
+            if entry is None or rank > entry.rank:
+                stack = AsyncExitStack()
+                client = await stack.enter_async_context(
+                    self.session.client(
+                        "lambda",
+                        region_name=region,
+                        aws_access_key_id=creds.access_key,
+                        aws_secret_access_key=creds.secret_key,
+                        aws_session_token=creds.token,
+                    )
+                )
+                replaced = entry
+                entry = self._clients[region] = _LambdaClient(rank, client, stack)
+            entry.in_flight += 1
+        if replaced is not None:
+            # No longer reachable through self._clients, so in_flight can
+            # only go down from here.
+            await self._retire(replaced)
+        return entry
+
+    async def _retire(self, entry: _LambdaClient):
+        if entry.in_flight:
+            self._retired.add(entry)
+        else:
+            await entry.stack.aclose()
+
+    async def _release(self, entry: _LambdaClient):
+        entry.in_flight -= 1
+        if not entry.in_flight and entry in self._retired:
+            self._retired.discard(entry)
+            await entry.stack.aclose()
+
+    async def invoke(
+        self,
+        function_arn: str,
+        region: str,
+        creds: Credentials,
+        params: Dict[str, str],
+        host: str = "localhost",
+    ) -> Response:
+        entry = await self._acquire(region, creds)
+        try:
+            timings = Timings()
+            result = await entry.client.invoke(
+                FunctionName=function_arn,
+                InvocationType="RequestResponse",
+                Payload=json.dumps(_function_url_event(host, params)).encode(),
+            )
+            timings.mark("headers")
+            payload = await result["Payload"].read()
+            timings.mark("end")
+        finally:
+            await self._release(entry)
+        if "FunctionError" in result:
+            return Response(502, payload, self.name, timings)
+        reply = json.loads(payload)
+        body = reply.get("body") or ""
+        if reply.get("isBase64Encoded"):
+            body = base64.b64decode(body)
+        else:
+            body = body.encode()
+        return Response(reply.get("statusCode", 200), body, self.name, timings)
+
+    async def close(self):
+        for entry in [*self._clients.values(), *self._retired]:
+            await entry.stack.aclose()
+        self._clients.clear()
+        self._retired.clear()
+
+
+class Transports:
+    """The transport to use for each provider, shared for the life of the app."""
+
+    def __init__(self, default: str = "http1", overrides: Dict[str, str] = {}):
+        self.http1 = Http1Transport()
+        self.http2: Optional[Http2Transport] = None
+        self._by_provider = {}
+        for provider in PROVIDERS:
+            kind = overrides.get(provider) or default
+            if kind == "http2":
+                if self.http2 is None:
+                    self.http2 = Http2Transport(self.http1)
+                self._by_provider[provider] = self.http2
+            elif kind == "http1":
+                self._by_provider[provider] = self.http1
+            else:
+                raise ValueError(f"Unknown transport {kind!r} for {provider}")
+
+    @classmethod
+    def from_env(cls) -> "Transports":
+        """
+        `TRANSPORT` sets the default (`http1` or `http2`), and
+        `TRANSPORT_<PROVIDER>`, e.g. `TRANSPORT_AZURE=http2`, overrides it per
+        provider.
+        """
+        return cls(
+            os.getenv("TRANSPORT", "http1"),
+            {
+                provider: os.getenv(f"TRANSPORT_{provider.upper()}")
+                for provider in PROVIDERS
+            },
+        )
+
+    def __getitem__(self, provider: str) -> Transport:
+        return self._by_provider[provider]
+
+    async def close(self):
+        if self.http2 is not None:
+            await self.http2.close()
+        await self.http1.close()
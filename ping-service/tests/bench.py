@@ -0,0 +1,322 @@
+"""
+Load benchmark for ping-service.
+
+Starts the simulated fleet from `tests.simulator`, runs ping-service against it
+in a subprocess and drives concurrent `GET /` streams at it:
+
+    python -m tests.bench --requests 200 --concurrency 20 --output run.json
+    python -m tests.bench --baseline run.json
+    python -m tests.bench --workers 1 2 4
+
+Reports requests/s, time-to-first-record, stream completion percentiles, CPU
+time per request and peak RSS of the service so runs can be compared.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from tests.simulator import Simulator, add_fleet_arguments, fleet_from_arguments
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _process_tree(pid: int) -> List[int]:
+    """`pid` and all of its descendants, read from /proc."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def _cpu_seconds(pids: List[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime, fields 14 and 15 of proc(5).
+        total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def _peak_rss_mib(pids: List[int]) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+class Service:
+    """ping-service running under `ping_thing.serve` in a child process."""
+
+    def __init__(self, env: Dict[str, str], port: int, workers: int = 1):
+        self.port = port
+        self.env = {
+            **os.environ,
+            **env,
+            "HOST": "127.0.0.1",
+            "PORT": str(port),
+            "WORKERS": str(workers),
+            "ACCESS_LOG": "0",
+        }
+        self.env.pop("SHARED_CACHE_SOCKET", None)
+        self.command = [sys.executable, "-m", "ping_thing.serve"]
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def pids(self) -> List[int]:
+        return _process_tree(self.process.pid)
+
+    async def __aenter__(self):
+        self.process = subprocess.Popen(self.command, env=self.env, cwd=SERVICE_DIR)
+        deadline = time.monotonic() + 60
+        async with aiohttp.ClientSession() as session:
+            while True:
+                if self.process.poll() is not None:
+                    raise RuntimeError("ping-service exited during startup")
+                try:
+                    async with session.get(f"{self.base_url}/readiness_check") as resp:
+                        if resp.status == 200:
+                            return self
+                except aiohttp.ClientError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise TimeoutError("ping-service did not become ready")
+                await asyncio.sleep(0.1)
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+@dataclass
+class Result:
+    requests: int
+    concurrency: int
+    regions: int
+    wall_s: float
+    requests_per_s: float
+    records_per_request: float
+    failed_requests: int
+    ttfr_p50_ms: float
+    ttfr_p99_ms: float
+    completion_p50_ms: float
+    completion_p99_ms: float
+    cpu_ms_per_request: float
+    peak_rss_mib: float
+    workers: int = 1
+    label: str = ""
+    simulator: Dict[str, int] = field(default_factory=dict)
+
+
+async def _stream(
+    session: aiohttp.ClientSession, url: str, target: str, token: str
+) -> tuple[float, float, int]:
+    start = time.perf_counter()
+    first = None
+    records = 0
+    async with session.get(
+        url,
+        params={"url": target},
+        headers={"Authorization": f"Bearer {token}"},
+    ) as resp:
+        resp.raise_for_status()
+        async for _ in resp.content:
+            if first is None:
+                first = time.perf_counter()
+            records += 1
+    end = time.perf_counter()
+    return (first or end) - start, end - start, records
+
+
+async def drive(
+    service: Service,
+    token: str,
+    requests: int,
+    concurrency: int,
+    target: str = "https://example.com",
+) -> tuple[float, List[float], List[float], List[int], int]:
+    """Runs `requests` streams, at most `concurrency` at a time."""
+    ttfr: List[float] = []
+    completion: List[float] = []
+    records: List[int] = []
+    failed = 0
+    remaining = iter(range(requests))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def worker():
+            nonlocal failed
+            for _ in remaining:
+                try:
+                    first, done, count = await _stream(
+                        session, f"{service.base_url}/", target, token
+                    )
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    failed += 1
+                    continue
+                ttfr.append(first)
+                completion.append(done)
+                records.append(count)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return wall, ttfr, completion, records, failed
+
+
+async def run(args: argparse.Namespace, workers: int = 1) -> Result:
+    simulator = Simulator(fleet_from_arguments(args), seed=args.seed)
+    async with simulator:
+        async with Service(simulator.env(), args.port, workers) as service:
+            token = simulator.user_token()
+            if args.warmup:
+                await drive(service, token, args.warmup, min(args.warmup, args.concurrency))
+            pids = service.pids()
+            cpu_before = _cpu_seconds(pids)
+            wall, ttfr, completion, records, failed = await drive(
+                service, token, args.requests, args.concurrency
+            )
+            pids = service.pids()
+            cpu = _cpu_seconds(pids) - cpu_before
+            peak_rss = _peak_rss_mib(pids)
+        completed = len(completion)
+        return Result(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            regions=len(simulator.fleet),
+            wall_s=wall,
+            requests_per_s=completed / wall if wall else 0.0,
+            records_per_request=statistics.fmean(records) if records else 0.0,
+            failed_requests=failed,
+            ttfr_p50_ms=_percentile(ttfr, 50) * 1000,
+            ttfr_p99_ms=_percentile(ttfr, 99) * 1000,
+            completion_p50_ms=_percentile(completion, 50) * 1000,
+            completion_p99_ms=_percentile(completion, 99) * 1000,
+            cpu_ms_per_request=cpu * 1000 / completed if completed else 0.0,
+            peak_rss_mib=peak_rss,
+            workers=workers,
+            label=args.label,
+            simulator=dict(simulator.counters),
+        )
+
+
+COLUMNS = [
+    ("requests_per_s", "requests/s", True),
+    ("ttfr_p50_ms", "first record p50 (ms)", False),
+    ("ttfr_p99_ms", "first record p99 (ms)", False),
+    ("completion_p50_ms", "completion p50 (ms)", False),
+    ("completion_p99_ms", "completion p99 (ms)", False),
+    ("cpu_ms_per_request", "cpu/request (ms)", False),
+    ("peak_rss_mib", "peak rss (MiB)", False),
+    ("records_per_request", "records/request", True),
+    ("failed_requests", "failed requests", False),
+]
+
+
+def report(result: Result, baseline: Optional[dict] = None):
+    print(
+        f"{result.label or 'run'}: {result.requests} requests, "
+        f"{result.concurrency} concurrent, {result.regions} regions, "
+        f"{result.workers} worker(s), {result.wall_s:.2f}s"
+    )
+    for key, name, higher_is_better in COLUMNS:
+        value = getattr(result, key)
+        line = f"  {name:<24}{value:>12.2f}"
+        if baseline and baseline.get(key) and value != baseline[key]:
+            change = (value - baseline[key]) / baseline[key] * 100
+            better = (change > 0) == higher_is_better
+            line += f"  {change:+7.1f}% {'better' if better else 'worse'}"
+        print(line)
+
+
+def add_load_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--warmup", type=int, default=5, help="Unmeasured requests sent first."
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="Worker counts to run; several values are compared against the first.",
+    )
+    parser.add_argument("--label", default="")
+    parser.add_argument("--output", help="Write the result as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare against a previous --output.")
+    add_fleet_arguments(parser)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = []
+    for workers in args.workers:
+        result = asyncio.run(run(args, workers))
+        report(result, baseline)
+        results.append(asdict(result))
+        if baseline is None and len(args.workers) > 1:
+            baseline = results[0]
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results[0] if len(results) == 1 else results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,616 @@
+"""
+Local stand-in for the deployed pinger fleet.
+
+Serves fake GCP, AWS, Azure and Alicloud pinger endpoints together with the
+bits of cloud plumbing `ping_thing.main` talks to (GCE metadata server, AWS
+STS, Cloudflare Access JWKS and a GCS object holding `config.json`), so the
+service can be run end to end without any real clouds:
+
+    python -m tests.simulator --regions 40 --latency lognormal:80:0.5
+
+prints the environment needed to point a ping-service at it.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import secrets
+import time
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import jwt
+from aiohttp import web
+from botocore import auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+POLICY_AUD = "simulator-policy-aud"
+CONFIG_BUCKET = "simulator-config"
+PROVIDERS = ("gcp", "aws", "azure", "alicloud")
+
+# Region names are only labels, but keeping them realistic makes the output
+# of a simulated run look like the real thing.
+REGION_NAMES = {
+    "gcp": [
+        "australia-southeast1", "asia-east1", "asia-northeast1", "asia-south1",
+        "europe-west1", "europe-west2", "europe-north1", "me-west1",
+        "northamerica-northeast1", "southamerica-east1", "us-central1",
+        "us-east1", "us-west1", "africa-south1",
+    ],
+    "aws": [
+        "ap-southeast-2", "ap-northeast-1", "ap-south-1", "eu-west-1",
+        "eu-central-1", "eu-north-1", "me-south-1", "sa-east-1",
+        "us-east-1", "us-east-2", "us-west-2", "af-south-1",
+    ],
+    "azure": [
+        "australiaeast", "eastasia", "japaneast", "centralindia",
+        "northeurope", "westeurope", "uksouth", "brazilsouth",
+        "eastus", "westus2", "southafricanorth", "uaenorth",
+    ],
+    "alicloud": [
+        "cn-beijing", "cn-hangzhou", "cn-hongkong", "ap-southeast-1",
+        "ap-northeast-1", "eu-central-1", "us-west-1", "us-east-1",
+    ],
+}
+
+
+@dataclass
+class Profile:
+    """How a simulated pinger behaves."""
+
+    distribution: str = "lognormal"
+    # Centre of the distribution in milliseconds.
+    latency_ms: float = 80.0
+    # Standard deviation for `normal`, shape for `lognormal`, half-width
+    # for `uniform`; ignored for `fixed`.
+    spread: float = 0.5
+    error_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall_ms: float = 5000.0
+    # Time the function takes on top of the target latency.
+    overhead_ms: float = 2.0
+    # Extra delay for the first call after the function has been idle for
+    # `idle_timeout_s`, as a scaled-to-zero function would see.
+    cold_start_ms: float = 0.0
+    idle_timeout_s: float = 900.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Profile":
+        """Parses `distribution:latency[:spread]`, e.g. `normal:50:10`."""
+        parts = spec.split(":")
+        profile = cls(distribution=parts[0])
+        if len(parts) > 1:
+            profile.latency_ms = float(parts[1])
+        if len(parts) > 2:
+            profile.spread = float(parts[2])
+        if profile.distribution not in ("fixed", "normal", "lognormal", "uniform"):
+            raise ValueError(f"Unknown latency distribution: {profile.distribution}")
+        return profile
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "fixed":
+            value = self.latency_ms
+        elif self.distribution == "normal":
+            value = rng.normalvariate(self.latency_ms, self.spread)
+        elif self.distribution == "uniform":
+            value = rng.uniform(
+                self.latency_ms - self.spread, self.latency_ms + self.spread
+            )
+        else:
+            value = self.latency_ms * rng.lognormvariate(0, self.spread)
+        return max(value, 0.0)
+
+
+@dataclass
+class Fleet:
+    """The set of simulated regions and how each of them behaves."""
+
+    regions: Dict[str, List[str]]
+    profile: Profile = field(default_factory=Profile)
+    overrides: Dict[Tuple[str, str], Profile] = field(default_factory=dict)
+    # Answer with the plain millisecond body of pingers that predate `format=1`.
+    legacy: bool = False
+
+    @classmethod
+    def build(cls, per_provider: int, profile: Optional[Profile] = None) -> "Fleet":
+        regions = {}
+        for provider in PROVIDERS:
+            names = REGION_NAMES[provider]
+            regions[provider] = [
+                names[i % len(names)]
+                + ("" if i < len(names) else f"-{i // len(names)}")
+                for i in range(per_provider)
+            ]
+        return cls(regions=regions, profile=profile or Profile())
+
+    def profile_for(self, provider: str, region: str) -> Profile:
+        return self.overrides.get((provider, region), self.profile)
+
+    def __len__(self):
+        return sum(len(regions) for regions in self.regions.values())
+
+
+class Simulator:
+    """
+    Runs the fake fleet on a single aiohttp server.
+
+    Every endpoint lives under one host:port, distinguished by path, so the
+    `urls` written into the simulated `config.json` point back at it.
+    """
+
+    def __init__(self, fleet: Fleet, host: str = "127.0.0.1", port: int = 0, seed=None):
+        self.fleet = fleet
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        # The `monitor` section of the simulated `config.json`.
+        self.monitor: Dict[str, object] = {}
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = secrets.token_hex(8)
+        self.issued: Dict[str, Credentials] = {}
+        self.last_called: Dict[Tuple[str, str], float] = {}
+        self.counters: Dict[str, int] = {
+            "pings": 0,
+            "errors": 0,
+            "stalls": 0,
+            "cold_starts": 0,
+            "rejected": 0,
+            "id_tokens": 0,
+            "sts": 0,
+            "jwks": 0,
+            "config": 0,
+        }
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def urls(self) -> Dict[str, Dict[str, str]]:
+        """The `urls` map the Pulumi program would publish for this fleet."""
+        base = self.base_url
+        urls = {}
+        for provider, regions in self.fleet.regions.items():
+            urls[f"faas.{provider}"] = {
+                region: {
+                    "gcp": f"{base}/gcp/{region}",
+                    # Half the AWS fleet goes through the "API Gateway" path so
+                    # both signing services are exercised.
+                    "aws": f"{base}/aws/{'lambda' if i % 2 == 0 else 'execute-api'}/{region}/",
+                    "azure": f"{base}/azure/{region}/api/pinger",
+                    "alicloud": f"{base}/alicloud/{region}",
+                }[provider]
+                for i, region in enumerate(regions)
+            }
+        return urls
+
+    def function_arns(self) -> Dict[str, str]:
+        """The Lambda ARN of every simulated AWS region, for Lambda Invoke."""
+        return {
+            region: f"arn:aws:lambda:{region}:000000000000:function:pinger-{region}"
+            for region in self.fleet.regions.get("aws", [])
+        }
+
+    def dispatch(self) -> dict:
+        """The dispatch manifest the Pulumi program would write for the fleet."""
+        auth = {"gcp": "id_token", "aws": "sigv4"}
+        function_arns = self.function_arns()
+        targets = []
+        for key, regions in self.urls().items():
+            provider = key.removeprefix("faas.")
+            for region, url in regions.items():
+                parts = urlsplit(url)
+                entry = {
+                    "provider": provider,
+                    "region": region,
+                    # Only a label here; the deploy derives the real one.
+                    "geography": region.split("-")[0],
+                    "url": url,
+                    "host": parts.netloc,
+                    "path": parts.path,
+                    "auth": auth.get(provider, "none"),
+                }
+                if provider == "aws":
+                    entry.update(
+                        signing_service=parts.path.split("/")[2],
+                        signing_region=region,
+                        function_arn=function_arns[region],
+                    )
+                targets.append(entry)
+        return {"version": 1, "targets": targets}
+
+    def env(self) -> Dict[str, str]:
+        """Environment variables that point a ping-service at this simulator."""
+        hostport = f"{self.host}:{self.port}"
+        return {
+            "CONFIG_BUCKET": CONFIG_BUCKET,
+            "STORAGE_EMULATOR_HOST": self.base_url,
+            "POLICY_AUD": POLICY_AUD,
+            "TEAM_DOMAIN": self.base_url,
+            "GCE_METADATA_HOST": hostport,
+            "GCE_METADATA_IP": hostport,
+            "AWS_ENDPOINT_URL_STS": f"{self.base_url}/sts",
+            "AWS_ENDPOINT_URL_LAMBDA": f"{self.base_url}/lambda",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_ACCESS_KEY_ID": "simulator",
+            "AWS_SECRET_ACCESS_KEY": "simulator",
+            "AWS_EC2_METADATA_DISABLED": "true",
+            "NO_PROXY": self.host,
+        }
+
+    def _sign(self, claims: dict, lifetime: int = 3600) -> str:
+        now = int(time.time())
+        return jwt.encode(
+            {"iat": now, "exp": now + lifetime, **claims},
+            self.key,
+            algorithm="RS256",
+            headers={"kid": self.kid},
+        )
+
+    def user_token(
+        self, email: str = "bench@example.com", lifetime: int = 3600, **claims
+    ) -> str:
+        """A Cloudflare Access style token accepted by `get_user_token`."""
+        return self._sign(
+            {"aud": [POLICY_AUD], "email": email, "iss": self.base_url, **claims},
+            lifetime=lifetime,
+        )
+
+    def _verify(self, token: str, audience: str) -> dict:
+        return jwt.decode(
+            token, self.key.public_key(), audience=audience, algorithms=["RS256"]
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes(
+            [
+                web.get("/", self._metadata_ping),
+                web.get(
+                    "/computeMetadata/v1/instance/service-accounts/default/",
+                    self._service_account,
+                ),
+                web.get(
+                    "/computeMetadata/v1/instance/service-accounts/default/identity",
+                    self._identity,
+                ),
+                web.post("/sts", self._sts),
+                web.post("/sts/", self._sts),
+                web.get("/cdn-cgi/access/certs", self._certs),
+                web.get("/download/storage/v1/b/{bucket}/o/{name}", self._config),
+                web.get("/gcp/{region}", self._gcp),
+                web.get("/aws/{service}/{region}/", self._aws),
+                web.post(
+                    "/lambda/2015-03-31/functions/{function}/invocations",
+                    self._invoke,
+                ),
+                web.get("/azure/{region}/api/pinger", self._anonymous("azure")),
+                web.get("/alicloud/{region}", self._anonymous("alicloud")),
+            ]
+        )
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _metadata_ping(self, request: web.Request):
+        return web.Response(text="", headers={"Metadata-Flavor": "Google"})
+
+    async def _service_account(self, request: web.Request):
+        return web.json_response(
+            {
+                "aliases": ["default"],
+                "email": "ping-service-account@simulator.iam.gserviceaccount.com",
+                "scopes": ["https://www.googleapis.com/auth/cloud-platform"],
+            },
+            headers={"Metadata-Flavor": "Google"},
+        )
+
+    async def _identity(self, request: web.Request):
+        self.counters["id_tokens"] += 1
+        audience = request.query.get("audience", "")
+        token = self._sign(
+            {"aud": audience, "iss": "https://accounts.google.com", "sub": "1234"}
+        )
+        return web.Response(text=token, headers={"Metadata-Flavor": "Google"})
+
+    async def _sts(self, request: web.Request):
+        self.counters["sts"] += 1
+        form = await request.post()
+        try:
+            claims = self._verify(form["WebIdentityToken"], "sts.amazonaws.com")
+        except (KeyError, jwt.exceptions.InvalidTokenError):
+            self.counters["rejected"] += 1
+            return web.Response(status=400, text="InvalidIdentityToken")
+        creds = Credentials(
+            access_key="ASIA" + secrets.token_hex(8).upper(),
+            secret_key=secrets.token_urlsafe(30),
+            token=secrets.token_urlsafe(60),
+        )
+        self.issued[creds.access_key] = creds
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+            hours=1
+        )
+        body = f"""<AssumeRoleWithWebIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleWithWebIdentityResult>
+    <Credentials>
+      <AccessKeyId>{creds.access_key}</AccessKeyId>
+      <SecretAccessKey>{creds.secret_key}</SecretAccessKey>
+      <SessionToken>{creds.token}</SessionToken>
+      <Expiration>{expiration.strftime("%Y-%m-%dT%H:%M:%SZ")}</Expiration>
+    </Credentials>
+    <SubjectFromWebIdentityToken>{claims["sub"]}</SubjectFromWebIdentityToken>
+    <AssumedRoleUser>
+      <Arn>arn:aws:sts::000000000000:assumed-role/ping-service-role/{form.get("RoleSessionName", "")}</Arn>
+      <AssumedRoleId>AROA000000000000:{form.get("RoleSessionName", "")}</AssumedRoleId>
+    </AssumedRoleUser>
+  </AssumeRoleWithWebIdentityResult>
+  <ResponseMetadata>
+    <RequestId>{secrets.token_hex(16)}</RequestId>
+  </ResponseMetadata>
+</AssumeRoleWithWebIdentityResponse>"""
+        return web.Response(text=body, content_type="text/xml")
+
+    async def _certs(self, request: web.Request):
+        self.counters["jwks"] += 1
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.key.public_key()))
+        jwk.update(kid=self.kid, alg="RS256", use="sig")
+        return web.json_response({"keys": [jwk]})
+
+    async def _config(self, request: web.Request):
+        self.counters["config"] += 1
+        if request.match_info["bucket"] != CONFIG_BUCKET:
+            return web.Response(status=404)
+        return web.json_response(
+            {
+                "urls": self.urls(),
+                "dispatch": self.dispatch(),
+                "monitor": self.monitor,
+            }
+        )
+
+    async def _ping(self, provider: str, request: web.Request):
+        return await self._pinger(provider, request.match_info["region"], request.query)
+
+    async def _pinger(self, provider: str, region: str, query) -> web.Response:
+        if "url" not in query or region not in self.fleet.regions[provider]:
+            return web.Response(status=400, text="Invalid query string")
+        self.counters["pings"] += 1
+        profile = self.fleet.profile_for(provider, region)
+        latency = profile.sample(self.rng)
+        delay = latency + profile.overhead_ms
+        now = time.monotonic()
+        last = self.last_called.get((provider, region))
+        self.last_called[(provider, region)] = now
+        if profile.cold_start_ms and (
+            last is None or now - last > profile.idle_timeout_s
+        ):
+            self.counters["cold_starts"] += 1
+            delay += profile.cold_start_ms
+        if profile.stall_rate and self.rng.random() < profile.stall_rate:
+            self.counters["stalls"] += 1
+            delay += profile.stall_ms
+        await asyncio.sleep(delay / 1000)
+        structured = query.get("format") == "1" and not self.fleet.legacy
+        if profile.error_rate and self.rng.random() < profile.error_rate:
+            self.counters["errors"] += 1
+            if structured:
+                return web.Response(text="1;;;;;;;;connect")
+            return web.Response(status=500, text="Unhandled rejection: TcpConnFailed")
+        if structured:
+            # Split the latency the way a real HTTPS target would roughly see it.
+            dns, connect = latency * 0.05, latency * 0.15
+            return web.Response(
+                text=f"1;{latency:.3f};{dns:.3f};{connect:.3f};;{latency - dns:.3f};"
+                f"200;203.0.113.{sum(region.encode()) % 250 + 1};"
+            )
+        return web.Response(text=f"{int(latency)}")
+
+    async def _gcp(self, request: web.Request):
+        header = request.headers.get("Authorization", "")
+        try:
+            self._verify(header.removeprefix("Bearer "), "pinger")
+        except jwt.exceptions.InvalidTokenError:
+            self.counters["rejected"] += 1
+            return web.Response(status=401, text="Unauthorized")
+        return await self._ping("gcp", request)
+
+    def _anonymous(self, provider: str):
+        async def handler(request: web.Request):
+            return await self._ping(provider, request)
+
+        return handler
+
+    async def _aws(self, request: web.Request):
+        if not self._check_sigv4(request):
+            self.counters["rejected"] += 1
+            return web.json_response(
+                {"message": "The request signature we calculated does not match"},
+                status=403,
+            )
+        return await self._ping("aws", request)
+
+    async def _invoke(self, request: web.Request):
+        """Lambda Invoke, answering with what the web adapter would return."""
+        function = unquote(request.match_info["function"])
+        region = function.split(":")[3] if function.startswith("arn:") else ""
+        if not self._check_sigv4(request, region, "lambda", await request.read()):
+            self.counters["rejected"] += 1
+            return web.json_response(
+                {"message": "The request signature we calculated does not match"},
+                status=403,
+            )
+        event = await request.json()
+        response = await self._pinger(
+            "aws", region, event.get("queryStringParameters") or {}
+        )
+        return web.json_response(
+            {
+                "statusCode": response.status,
+                "headers": {"content-type": response.content_type},
+                "body": response.text,
+                "isBase64Encoded": False,
+            }
+        )
+
+    def _check_sigv4(
+        self,
+        request: web.Request,
+        region: Optional[str] = None,
+        service: Optional[str] = None,
+        body: bytes = b"",
+    ) -> bool:
+        """
+        Recomputes the SigV4 signature the way Lambda / API Gateway would.
+
+        `region` and `service` default to the ones in the request path.
+        """
+        try:
+            region = region or request.match_info["region"]
+            service = service or request.match_info["service"]
+            algorithm, fields = request.headers["Authorization"].split(" ", 1)
+            parts = dict(
+                part.strip().split("=", 1) for part in fields.split(",")
+            )
+            access_key, _, signed_region, signed_service, _ = parts[
+                "Credential"
+            ].split("/")
+            signed_headers = parts["SignedHeaders"].split(";")
+            creds = self.issued[access_key]
+            if (
+                algorithm != "AWS4-HMAC-SHA256"
+                or signed_region != region
+                or signed_service != service
+            ):
+                return False
+            aws_request = AWSRequest(
+                method=request.method,
+                url=f"http://{request.host}{urlsplit(request.raw_path).path}",
+                headers={name: request.headers[name] for name in signed_headers},
+                params=dict(request.query),
+                data=body,
+            )
+            aws_request.context["timestamp"] = request.headers["X-Amz-Date"]
+            signer = auth.SigV4Auth(creds, service, region)
+            canonical_request = signer.canonical_request(aws_request)
+            string_to_sign = signer.string_to_sign(aws_request, canonical_request)
+            expected = signer.signature(string_to_sign, aws_request)
+        except (KeyError, ValueError):
+            return False
+        return secrets.compare_digest(expected, parts["Signature"])
+
+
+def _parse_override(spec: str) -> Tuple[Tuple[str, str], Profile]:
+    """Parses `provider/region=distribution:latency[:spread]`."""
+    target, profile = spec.split("=", 1)
+    provider, region = target.split("/", 1)
+    return (provider, region), Profile.parse(profile)
+
+
+def add_fleet_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--regions", type=int, default=12, help="Simulated regions per provider."
+    )
+    parser.add_argument(
+        "--latency",
+        type=Profile.parse,
+        default=Profile(),
+        help="Latency distribution as distribution:ms[:spread], "
+        "e.g. lognormal:80:0.5, normal:50:10, fixed:20.",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-ms", type=float, default=5000.0)
+    parser.add_argument("--cold-start-ms", type=float, default=0.0)
+    parser.add_argument("--idle-timeout", type=float, default=900.0)
+    parser.add_argument(
+        "--override",
+        action="append",
+        type=_parse_override,
+        default=[],
+        help="Per region profile as provider/region=distribution:ms[:spread].",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="Reply with the plain integer body of pingers without format=1.",
+    )
+
+
+def fleet_from_arguments(args: argparse.Namespace) -> Fleet:
+    profile = replace(
+        args.latency,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_ms=args.stall_ms,
+        cold_start_ms=args.cold_start_ms,
+        idle_timeout_s=args.idle_timeout,
+    )
+    fleet = Fleet.build(args.regions, profile)
+    fleet.overrides.update(dict(args.override))
+    fleet.legacy = args.legacy
+    return fleet
+
+
+async def _serve(args: argparse.Namespace):
+    simulator = Simulator(
+        fleet_from_arguments(args), host=args.host, port=args.port, seed=args.seed
+    )
+    if args.monitor:
+        simulator.monitor = {
+            "targets": args.monitor,
+            "interval": args.monitor_interval,
+        }
+    async with simulator:
+        for name, value in simulator.env().items():
+            print(f"export {name}={value!r}")
+        print(f"# Authorization: Bearer {simulator.user_token(lifetime=86400)}")
+        print(f"# Serving {len(simulator.fleet)} regions on {simulator.base_url}")
+        await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument(
+        "--monitor",
+        action="append",
+        default=[],
+        metavar="URL",
+        help="Add a monitor target to the simulated config.",
+    )
+    parser.add_argument(
+        "--monitor-interval",
+        type=float,
+        default=5,
+        help="Seconds between monitor rounds.",
+    )
+    add_fleet_arguments(parser)
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
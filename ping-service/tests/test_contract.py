@@ -0,0 +1,63 @@
+import unittest
+
+from ping_thing import contract
+
+
+class ParseTest(unittest.TestCase):
+    def test_format_1(self):
+        result = contract.parse(b"1;51.5;0.4;1.0;3.3;46.8;204;203.0.113.7;")
+        self.assertEqual(
+            result,
+            contract.PingerResult(1, 51.5, 0.4, 1.0, 3.3, 46.8, 204, "203.0.113.7"),
+        )
+
+    def test_format_1_unmeasured_fields(self):
+        result = contract.parse(b"1;0.8;0.002;0.795;;;;127.0.0.1;")
+        self.assertEqual(result.tls_ms, None)
+        self.assertEqual(result.ttfb_ms, None)
+        self.assertEqual(result.status, None)
+        self.assertEqual(result.error, None)
+
+    def test_format_1_error(self):
+        result = contract.parse(b"1;;0.002;;;;;127.0.0.1;connect")
+        self.assertEqual(result.version, 1)
+        self.assertEqual(result.total_ms, None)
+        self.assertEqual(result.dns_ms, 0.002)
+        self.assertEqual(result.ip, "127.0.0.1")
+        self.assertEqual(result.error, "connect")
+
+    def test_format_1_error_without_ip(self):
+        result = contract.parse(b"1;;;;;;;;dns\n")
+        self.assertEqual(result.ip, None)
+        self.assertEqual(result.error, "dns")
+
+    def test_short_format_1_body(self):
+        result = contract.parse(b"1;")
+        self.assertEqual(result, contract.PingerResult(0, error="1;"))
+
+    def test_malformed_format_1_number(self):
+        result = contract.parse(b"1;abc;;;;;;;")
+        self.assertEqual(result.version, 0)
+        self.assertEqual(result.error, "1;abc;;;;;;;")
+
+    def test_legacy_digits(self):
+        self.assertEqual(contract.parse(b"123"), contract.PingerResult(0, 123.0))
+
+    def test_legacy_digits_with_newline(self):
+        self.assertEqual(contract.parse(b"123\n"), contract.PingerResult(0, 123.0))
+
+    def test_legacy_digits_on_error_status(self):
+        result = contract.parse(b"123", http_status=500)
+        self.assertEqual(result, contract.PingerResult(0, error="123"))
+
+    def test_legacy_error_message(self):
+        result = contract.parse(b"Unhandled rejection: TcpConnFailed", 500)
+        self.assertEqual(result.error, "Unhandled rejection: TcpConnFailed")
+
+    def test_empty_body(self):
+        result = contract.parse(b"", http_status=502)
+        self.assertEqual(result, contract.PingerResult(0, error="HTTP 502"))
+
+
+if __name__ == "__main__":
+    unittest.main()
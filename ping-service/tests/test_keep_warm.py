@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+
+from ping_thing import keep_warm
+from ping_thing.keep_warm import STATE_KEY, KeepWarm
+from ping_thing.shared_cache import LocalCache
+
+TARGETS = [("gcp", f"region-{i}") for i in range(5)]
+
+
+class KeepWarmTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 1_000_000.0
+        patcher = mock.patch.object(keep_warm.time, "time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.batches = []
+
+    async def warm(self, batch):
+        self.batches.append([region for _, region in batch])
+
+    def keep_warm(self, budget, cache=None):
+        return KeepWarm(lambda: TARGETS, self.warm, 60, budget=budget, cache=cache)
+
+    async def test_no_budget_warms_every_target(self):
+        warmer = self.keep_warm(0)
+        await warmer.round()
+        await warmer.round()
+        self.assertEqual([len(batch) for batch in self.batches], [5, 5])
+
+    async def test_budget_caps_calls_per_hour(self):
+        warmer = self.keep_warm(3)
+        for _ in range(6):
+            await warmer.round()
+            self.now += 60
+        # 3 up front, then 3 per hour refill: none more within 6 minutes.
+        self.assertEqual(sum(len(batch) for batch in self.batches), 3)
+        self.now += 1200
+        await warmer.round()
+        # 26 minutes in, 1.3 tokens have come back.
+        self.assertEqual(self.batches[-1], ["region-3"])
+
+    async def test_next_round_resumes_where_last_stopped(self):
+        warmer = self.keep_warm(3)
+        await warmer.round()
+        self.now += 3600
+        await warmer.round()
+        self.assertEqual(
+            self.batches,
+            [
+                ["region-0", "region-1", "region-2"],
+                ["region-3", "region-4", "region-0"],
+            ],
+        )
+
+    async def test_budget_shared_between_workers(self):
+        cache = LocalCache()
+        workers = [self.keep_warm(3, cache), self.keep_warm(3, cache)]
+        for worker in workers:
+            await worker.round()
+        self.assertEqual(self.batches, [["region-0", "region-1", "region-2"]])
+
+    async def test_state_saved_before_warming(self):
+        cache = LocalCache()
+        seen = []
+
+        async def warm(batch):
+            seen.append(await cache.get(STATE_KEY))
+
+        warmer = KeepWarm(lambda: TARGETS, warm, 60, budget=3, cache=cache)
+        await warmer.round()
+        self.assertEqual(seen[0]["next"], 3)
+        self.assertEqual(seen[0]["tokens"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import math
+import unittest
+
+from ping_thing.monitor import Monitor, RollingWindow
+from ping_thing.shared_cache import LocalCache
+
+
+class RollingWindowTest(unittest.TestCase):
+    def test_empty(self):
+        window = RollingWindow(3)
+        snapshot = window.snapshot()
+        self.assertEqual(snapshot["samples"], 0)
+        self.assertIsNone(snapshot["mean_ms"])
+        self.assertIsNone(snapshot["min_ms"])
+        self.assertIsNone(snapshot["p50_ms"])
+
+    def test_aggregates(self):
+        window = RollingWindow(4)
+        for value in (10, 20, 30):
+            window.add(value)
+        self.assertEqual(window.count, 3)
+        self.assertEqual(window.total, 60)
+        self.assertEqual(window.snapshot()["mean_ms"], 20)
+        self.assertEqual((window.min, window.max), (10, 30))
+        self.assertEqual(window.last, 30)
+
+    def test_evicting_min_and_max(self):
+        window = RollingWindow(3)
+        for value in (1, 50, 20):
+            window.add(value)
+        window.add(30)  # evicts the minimum
+        self.assertEqual((window.min, window.max), (20, 50))
+        window.add(25)  # evicts the maximum
+        self.assertEqual((window.min, window.max), (20, 30))
+        self.assertEqual(window.values(), [20, 30, 25])
+        self.assertEqual(window.total, 75)
+
+    def test_evicting_the_only_sample(self):
+        window = RollingWindow(1)
+        window.add(5)
+        window.add(None)
+        self.assertEqual(window.count, 0)
+        self.assertEqual((window.min, window.max), (math.inf, -math.inf))
+        self.assertIsNone(window.snapshot()["min_ms"])
+
+    def test_failures(self):
+        window = RollingWindow(3)
+        window.add(10)
+        window.add(None)
+        window.add(None)
+        snapshot = window.snapshot()
+        self.assertEqual((snapshot["samples"], snapshot["failures"]), (1, 2))
+        self.assertIsNone(snapshot["last_ms"])
+        self.assertEqual(snapshot["mean_ms"], 10)
+        window.add(20)  # evicts 10
+        window.add(30)  # evicts a failure
+        self.assertEqual((window.count, window.failures), (2, 1))
+        self.assertEqual(window.values(), [None, 20, 30])
+
+    def test_percentiles(self):
+        window = RollingWindow(100)
+        for value in range(1, 101):
+            window.add(value)
+        # Histogram buckets are 4% wide.
+        self.assertAlmostEqual(window.percentile(50), 50, delta=50 * 0.04)
+        self.assertAlmostEqual(window.percentile(90), 90, delta=90 * 0.04)
+        self.assertAlmostEqual(window.percentile(99), 99, delta=99 * 0.04)
+        self.assertEqual(window.percentile(100), 100)
+
+    def test_percentiles_clamped_to_samples(self):
+        window = RollingWindow(5)
+        for _ in range(5):
+            window.add(42.0)
+        for pct in (1, 50, 99):
+            self.assertEqual(window.percentile(pct), 42.0)
+
+    def test_percentiles_after_eviction(self):
+        window = RollingWindow(10)
+        for value in [1000] * 10 + [10] * 10:
+            window.add(value)
+        self.assertEqual(window.percentile(99), 10)
+
+    def test_restore(self):
+        window = RollingWindow(3)
+        for value in (1, None, 2, 3):
+            window.add(value)
+        restored = RollingWindow.restore(3, window.values(), window.updated)
+        self.assertEqual(restored.snapshot(), window.snapshot())
+
+
+class MonitorTest(unittest.IsolatedAsyncioTestCase):
+    def monitor(self, cache, results):
+        async def ping_round(target):
+            for region, latency in results.items():
+                yield "aws", region, latency
+
+        return Monitor(cache, ping_round, ["https://example.com"], interval=10)
+
+    async def test_only_the_leader_pings(self):
+        cache = LocalCache()
+        a = self.monitor(cache, {"us-east-1": 10.0})
+        b = self.monitor(cache, {"us-east-1": 99.0})
+        await a.tick()
+        await b.tick()
+        self.assertTrue(a.leading)
+        self.assertFalse(b.leading)
+        self.assertEqual(b.windows["https://example.com"], {})
+        self.assertEqual(await b.snapshot(), a.local_snapshot())
+
+    async def test_failover_keeps_history_and_drops_stale_windows(self):
+        cache = LocalCache()
+        a = self.monitor(cache, {"us-east-1": 10.0})
+        b = self.monitor(cache, {"us-east-1": 20.0})
+        await a.tick()
+        await a.tick()
+        # a's lease runs out and b takes over.
+        await cache.set("monitor:leader", b.worker_id, 30)
+        await b.tick()
+        await a.tick()
+        self.assertFalse(a.leading)
+        self.assertTrue(b.leading)
+        window = b.windows["https://example.com"]["aws/us-east-1"]
+        self.assertEqual(window.values(), [10.0, 10.0, 20.0])
+        # a still holds windows of its own, but serves the leader's.
+        snapshot = await a.snapshot()
+        self.assertEqual(snapshot, b.local_snapshot())
+        stats = snapshot["targets"]["https://example.com"]["aws/us-east-1"]
+        self.assertEqual(stats["samples"], 3)
+
+    async def test_snapshot_without_a_leader(self):
+        cache = LocalCache()
+        a = self.monitor(cache, {"us-east-1": 10.0})
+        snapshot = await a.snapshot()
+        self.assertEqual(snapshot["targets"], {"https://example.com": {}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from ping_thing import shared_cache
+from ping_thing.shared_cache import LocalCache, get_or_load
+
+
+class GetOrLoadTest(unittest.IsolatedAsyncioTestCase):
+    async def test_cached_value_skips_loader(self):
+        cache = LocalCache()
+        await cache.set("key", "cached", 60)
+
+        async def loader():
+            raise AssertionError("loaded")
+
+        self.assertEqual(await get_or_load(cache, "key", loader), "cached")
+
+    async def test_second_caller_waits_for_first_loader(self):
+        cache = LocalCache()
+        calls = []
+        release = asyncio.Event()
+
+        async def loader():
+            calls.append(1)
+            await release.wait()
+            return "value", 60
+
+        first = asyncio.create_task(get_or_load(cache, "key", loader))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(get_or_load(cache, "key", loader))
+        await asyncio.sleep(shared_cache.POLL_INTERVAL * 2)
+        self.assertFalse(second.done())
+        release.set()
+        self.assertEqual(await asyncio.gather(first, second), ["value", "value"])
+        self.assertEqual(len(calls), 1)
+
+    async def test_failing_loader_releases_lock(self):
+        cache = LocalCache()
+
+        async def failing():
+            raise RuntimeError("upstream down")
+
+        async def loader():
+            return "value", 60
+
+        with self.assertRaises(RuntimeError):
+            await get_or_load(cache, "key", failing)
+        self.assertTrue(await cache.lock("key"))
+        await cache.unlock("key")
+        self.assertEqual(await get_or_load(cache, "key", loader), "value")
+
+    async def test_non_positive_ttl_not_stored(self):
+        cache = LocalCache()
+        for ttl in (0, -5):
+            calls = []
+
+            async def loader():
+                calls.append(1)
+                return "expired", ttl
+
+            self.assertEqual(await get_or_load(cache, "key", loader), "expired")
+            self.assertIsNone(await cache.get("key"))
+            await get_or_load(cache, "key", loader)
+            self.assertEqual(len(calls), 2)
+
+    async def test_loads_itself_when_lock_holder_never_fills(self):
+        cache = LocalCache()
+        # Another worker took the lock and went away.
+        await cache.lock("key", ttl=60)
+
+        async def loader():
+            return "value", 60
+
+        with mock.patch.object(shared_cache, "LOCK_TTL", 0.2):
+            self.assertEqual(await get_or_load(cache, "key", loader), "value")
+        self.assertEqual(await cache.get("key"), "value")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,241 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import time
+import unittest
+import zlib
+
+import msgpack
+
+from ping_thing import streaming
+
+
+async def _source(*items):
+    """Yields strings at once and sleeps for floats, in order."""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+class CoalesceTest(unittest.IsolatedAsyncioTestCase):
+    async def test_first_chunk_is_sent_alone(self):
+        chunks = streaming.coalesce(_source("a", "b", "c"), 10.0, 8)
+        start = time.monotonic()
+        self.assertEqual(await chunks.__anext__(), "a")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(await _collect(chunks), ["bc"])
+
+    async def test_flush_at_max_records(self):
+        items = [str(i) for i in range(1, 9)]
+        chunks = streaming.coalesce(_source(*items, 10.0), 10.0, 3)
+        self.assertEqual(
+            [await asyncio.wait_for(chunks.__anext__(), 1) for _ in range(3)],
+            ["1", "234", "567"],
+        )
+        await chunks.aclose()
+
+    async def test_remainder_flushed_at_end(self):
+        items = [str(i) for i in range(1, 9)]
+        chunks = streaming.coalesce(_source(*items), 10.0, 3)
+        self.assertEqual(
+            await asyncio.wait_for(_collect(chunks), 1), ["1", "234", "567", "8"]
+        )
+
+    async def test_flush_when_window_expires(self):
+        chunks = streaming.coalesce(_source("a", "b", "c", 0.3, "d"), 0.05, 8)
+        self.assertEqual(await _collect(chunks), ["a", "bc", "d"])
+
+    async def test_chunks_within_window_are_joined(self):
+        chunks = streaming.coalesce(_source("a", "b", 0.05, "c", 0.05, "d"), 0.5, 8)
+        self.assertEqual(await _collect(chunks), ["a", "bcd"])
+
+    async def test_bytes(self):
+        chunks = streaming.coalesce(_source(b"a", b"b", b"c"), 10.0, 8)
+        self.assertEqual(await _collect(chunks), [b"a", b"bc"])
+
+    async def test_disabled(self):
+        for window, max_records in ((0, 8), (0.5, 1)):
+            chunks = streaming.coalesce(_source("a", "b", "c"), window, max_records)
+            self.assertEqual(await _collect(chunks), ["a", "b", "c"])
+
+    async def test_close_cancels_pending_read(self):
+        cancelled = asyncio.Event()
+
+        async def source():
+            yield "a"
+            yield "b"
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        chunks = streaming.coalesce(source(), 0.05, 8)
+        self.assertEqual(await chunks.__anext__(), "a")
+        # Flushed by the window while the next read is still pending.
+        self.assertEqual(await chunks.__anext__(), "b")
+        await chunks.aclose()
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+
+RECORD = {
+    "provider": "aws",
+    "region": "eu-west-1",
+    "latency": "12.5",
+    "ok": True,
+    "ip": None,
+}
+FIELDS = ["provider", "region", "latency", "ok", "ip"]
+
+
+class NegotiateEncoderTest(unittest.TestCase):
+    def test_default_is_ndjson(self):
+        for accept in (None, "", "*/*", "application/*"):
+            self.assertIs(streaming.negotiate_encoder(accept), streaming.NdjsonEncoder)
+
+    def test_json_and_unknown_types_get_ndjson(self):
+        for accept in ("application/json", "text/html", "image/png;q=0.5"):
+            self.assertIs(streaming.negotiate_encoder(accept), streaming.NdjsonEncoder)
+
+    def test_supported_types(self):
+        self.assertIs(streaming.negotiate_encoder("text/csv"), streaming.CsvEncoder)
+        for media_type in (
+            "application/x-msgpack",
+            "application/msgpack",
+            "application/vnd.msgpack",
+        ):
+            self.assertIs(
+                streaming.negotiate_encoder(media_type), streaming.MsgpackEncoder
+            )
+
+    def test_quality_and_order(self):
+        self.assertIs(
+            streaming.negotiate_encoder("text/csv;q=0.5, application/x-msgpack"),
+            streaming.MsgpackEncoder,
+        )
+        self.assertIs(
+            streaming.negotiate_encoder("text/csv, application/x-msgpack"),
+            streaming.CsvEncoder,
+        )
+        self.assertIs(
+            streaming.negotiate_encoder("application/json, text/csv;q=0.9"),
+            streaming.CsvEncoder,
+        )
+
+    def test_refused_types_are_skipped(self):
+        self.assertIs(
+            streaming.negotiate_encoder("text/csv;q=0, application/x-msgpack;q=0.1"),
+            streaming.MsgpackEncoder,
+        )
+        self.assertIs(
+            streaming.negotiate_encoder("TEXT/CSV;q=0"), streaming.NdjsonEncoder
+        )
+
+    def test_case_and_whitespace(self):
+        self.assertIs(
+            streaming.negotiate_encoder("  Text/CSV ; q=1 "), streaming.CsvEncoder
+        )
+
+
+class NegotiateCompressorTest(unittest.TestCase):
+    def test_none(self):
+        for accept_encoding in (None, "", "identity", "br", "gzip;q=0"):
+            self.assertIsNone(streaming.negotiate_compressor(accept_encoding))
+
+    def test_gzip(self):
+        self.assertIs(
+            streaming.negotiate_compressor("br, gzip"), streaming.GzipCompressor
+        )
+
+    def test_identity_preferred(self):
+        self.assertIsNone(streaming.negotiate_compressor("identity, gzip;q=0.5"))
+
+    def test_bad_quality_is_refused(self):
+        self.assertIsNone(streaming.negotiate_compressor("gzip;q=x"))
+
+    @unittest.skipIf(streaming.zstd is None, "zstd needs Python 3.14")
+    def test_zstd_wins_ties(self):
+        self.assertIs(
+            streaming.negotiate_compressor("gzip, zstd"), streaming.ZstdCompressor
+        )
+        self.assertIs(
+            streaming.negotiate_compressor("gzip, zstd;q=0.5"),
+            streaming.GzipCompressor,
+        )
+
+
+class EncoderTest(unittest.TestCase):
+    def test_ndjson(self):
+        encoder = streaming.NdjsonEncoder(FIELDS)
+        self.assertEqual(encoder.header(), b"")
+        line = encoder.encode(RECORD)
+        self.assertTrue(line.endswith(b"\n"))
+        self.assertEqual(json.loads(line), RECORD)
+
+    def test_csv(self):
+        encoder = streaming.CsvEncoder(FIELDS)
+        body = encoder.header() + encoder.encode(RECORD) + encoder.encode(
+            {"provider": "gcp", "region": 'a,"b"', "ok": False}
+        )
+        self.assertEqual(
+            body,
+            b"provider,region,latency,ok,ip\n"
+            b"aws,eu-west-1,12.5,true,\n"
+            b'gcp,"a,""b""",,false,\n',
+        )
+        rows = list(csv.reader(io.StringIO(body.decode())))
+        self.assertEqual(rows[2][1], 'a,"b"')
+
+    def test_msgpack(self):
+        encoder = streaming.MsgpackEncoder(FIELDS)
+        self.assertEqual(encoder.header(), b"")
+        second = dict(RECORD, region="us-east-1")
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(encoder.encode(RECORD) + encoder.encode(second))
+        self.assertEqual(list(unpacker), [RECORD, second])
+
+
+async def _records(*records):
+    for record in records:
+        yield record
+
+
+class EncodeTest(unittest.IsolatedAsyncioTestCase):
+    async def test_header_rides_with_first_record(self):
+        chunks = await _collect(
+            streaming.encode(_records(RECORD, RECORD), streaming.CsvEncoder(FIELDS))
+        )
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith(b"provider,region"))
+        self.assertEqual(chunks[0].count(b"\n"), 2)
+
+    async def test_header_alone_without_records(self):
+        chunks = await _collect(
+            streaming.encode(_records(), streaming.CsvEncoder(FIELDS))
+        )
+        self.assertEqual(chunks, [b"provider,region,latency,ok,ip\n"])
+        chunks = await _collect(
+            streaming.encode(_records(), streaming.NdjsonEncoder(FIELDS))
+        )
+        self.assertEqual(chunks, [])
+
+    async def test_gzip_chunks_decode_as_they_arrive(self):
+        compressor = streaming.GzipCompressor()
+        decoder = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        chunks = await _collect(
+            streaming.compress(_source(b"one\n", b"two\n"), compressor)
+        )
+        self.assertEqual(decoder.decompress(chunks[0]), b"one\n")
+        self.assertEqual(gzip.decompress(b"".join(chunks)), b"one\ntwo\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
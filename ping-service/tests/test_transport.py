@@ -0,0 +1,123 @@
+import asyncio
+import json
+import unittest
+from contextlib import asynccontextmanager
+
+from botocore.credentials import Credentials
+
+from ping_thing.transport import LambdaInvokeTransport
+
+
+class _Payload:
+    async def read(self):
+        return json.dumps({"statusCode": 200, "body": "1;5.0;;;;;200;;"}).encode()
+
+
+class _FakeLambda:
+    def __init__(self, access_key, gate):
+        self.access_key = access_key
+        self.gate = gate
+        self.closed = False
+        self.invokes = 0
+
+    async def invoke(self, **kwargs):
+        if self.closed:
+            raise RuntimeError("client closed")
+        self.invokes += 1
+        await self.gate.wait()
+        if self.closed:
+            raise RuntimeError("client closed")
+        return {"Payload": _Payload()}
+
+
+class _FakeSession:
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.clients = []
+
+    @asynccontextmanager
+    async def client(self, service, aws_access_key_id, **kwargs):
+        client = _FakeLambda(aws_access_key_id, self.gate)
+        self.clients.append(client)
+        try:
+            yield client
+        finally:
+            # Closing takes a moment, as aiobotocore's does.
+            await asyncio.sleep(0)
+            client.closed = True
+
+
+def _creds(key):
+    return Credentials(key, "secret", "token")
+
+
+class LambdaInvokeTransportTest(unittest.IsolatedAsyncioTestCase):
+    async def invoke(self, transport, key):
+        return await transport.invoke(
+            "arn:aws:lambda:eu-west-1:0:function:pinger", "eu-west-1", _creds(key), {}
+        )
+
+    async def test_client_reused_for_same_credentials(self):
+        session = _FakeSession()
+        session.gate.set()
+        transport = LambdaInvokeTransport(session)
+        await self.invoke(transport, "a")
+        await self.invoke(transport, "a")
+        self.assertEqual(len(session.clients), 1)
+        await transport.close()
+        self.assertTrue(session.clients[0].closed)
+
+    async def test_rotation_waits_for_in_flight_invokes(self):
+        session = _FakeSession()
+        transport = LambdaInvokeTransport(session)
+        before = asyncio.create_task(self.invoke(transport, "a"))
+        await asyncio.sleep(0)
+        # The credentials rotate while the first invoke is still running.
+        after = asyncio.create_task(self.invoke(transport, "b"))
+        await asyncio.sleep(0)
+        old, new = session.clients
+        self.assertFalse(old.closed)
+        session.gate.set()
+        responses = await asyncio.gather(before, after)
+        self.assertEqual([r.status for r in responses], [200, 200])
+        self.assertTrue(old.closed)
+        self.assertFalse(new.closed)
+        await transport.close()
+        self.assertTrue(new.closed)
+
+    async def test_idle_client_closed_on_rotation(self):
+        session = _FakeSession()
+        session.gate.set()
+        transport = LambdaInvokeTransport(session)
+        await self.invoke(transport, "a")
+        await self.invoke(transport, "b")
+        self.assertEqual([c.closed for c in session.clients], [True, False])
+        await transport.close()
+
+    async def test_invoke_during_close_uses_new_client(self):
+        session = _FakeSession()
+        session.gate.set()
+        transport = LambdaInvokeTransport(session)
+        await self.invoke(transport, "a")
+        # One invoke rotates to "b" while another still holds "a".
+        responses = await asyncio.gather(
+            self.invoke(transport, "b"), self.invoke(transport, "a")
+        )
+        self.assertEqual([r.status for r in responses], [200, 200])
+        self.assertEqual([c.access_key for c in session.clients], ["a", "b"])
+        self.assertEqual([c.invokes for c in session.clients], [1, 2])
+        await transport.close()
+
+    async def test_older_credentials_dont_switch_back(self):
+        session = _FakeSession()
+        session.gate.set()
+        transport = LambdaInvokeTransport(session)
+        for key in ["a", "b", "a", "b", "a"]:
+            await self.invoke(transport, key)
+        self.assertEqual([c.access_key for c in session.clients], ["a", "b"])
+        self.assertEqual([c.closed for c in session.clients], [True, False])
+        await transport.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+The regions each provider is deployed to.
+
+They are listed per provider in `catalog/regions.json`, which is committed,
+so deploys read it without asking the providers and any change to it shows
+up as a diff:
+
+- `deploy`: regions that are deployed to.
+- `skip`: regions the provider offers that aren't deployed to.
+- `pending`: regions the provider started offering since the last review.
+  They aren't deployed to until they're moved to `deploy` (or `skip`).
+
+`PINGALL_REFRESH_REGIONS=1` asks the providers again. New regions go to
+`pending`, or straight to `skip` if they match `EXCLUDE`, and regions that
+went away are reported in the deploy log. A provider missing from the catalog
+is looked up on the next deploy, with every region deployed but the
+`EXCLUDE` ones. Either way the catalog changes need committing.
+"""
+
+import fnmatch
+import json
+import os
+import threading
+import time
+
+import pulumi
+
+root = os.path.dirname(os.path.realpath(__file__))
+CATALOG_PATH = os.path.join(root, "catalog", "regions.json")
+REFRESH = os.environ.get("PINGALL_REFRESH_REGIONS") == "1"
+
+# Regions that go straight to `skip` when they're catalogued, as fnmatch
+# patterns.
+EXCLUDE = {
+    "gcp": [
+        # Left out when the list was kept by hand.
+        "me-central2",
+        "europe-north2",
+    ],
+    "aws": [],
+    "azure": [
+        # Canary and staging regions.
+        "*euap",
+        "*stg",
+        "brazilus",
+        # Restricted to Jio customers.
+        "jioindia*",
+    ],
+    "alicloud": [
+        "*-finance-*",
+    ],
+}
+
+_write_lock = threading.Lock()
+_locks = {provider: threading.Lock() for provider in EXCLUDE}
+_resolved: dict[str, list[str]] = {}
+# (log function, message) pairs from this run, for the main thread to log
+# once discovery is done.
+notes: list[tuple] = []
+
+
+def excluded(provider: str, location: str) -> bool:
+    return any(fnmatch.fnmatchcase(location, rule) for rule in EXCLUDE[provider])
+
+
+def load() -> dict:
+    try:
+        with open(CATALOG_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _store(provider: str, entry: dict):
+    # Providers refresh from different threads; re-read so none is lost.
+    with _write_lock:
+        catalog = load()
+        catalog[provider] = entry
+        os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+        with open(CATALOG_PATH, "w") as f:
+            json.dump(catalog, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def _refresh(provider: str, fetch, previous) -> dict:
+    available = set(fetch())
+    entry = {"checked": time.strftime("%Y-%m-%d", time.gmtime())}
+    if previous is None:
+        skip = {loc for loc in available if excluded(provider, loc)}
+        entry["deploy"] = sorted(available - skip)
+        entry["skip"] = sorted(skip)
+        entry["pending"] = []
+        notes.append(
+            (
+                pulumi.warn,
+                f"Catalogued {len(entry['deploy'])} {provider} regions in "
+                f"{os.path.relpath(CATALOG_PATH, root)}; commit it.",
+            )
+        )
+        _store(provider, entry)
+        return entry
+
+    known = {*previous["deploy"], *previous["skip"], *previous["pending"]}
+    added = available - known
+    # Deployed regions stay until they're taken out by hand, since their
+    # resources need tearing down.
+    entry["deploy"] = previous["deploy"]
+    entry["skip"] = sorted(
+        {loc for loc in previous["skip"] if loc in available}
+        | {loc for loc in added if excluded(provider, loc)}
+    )
+    entry["pending"] = sorted(
+        {loc for loc in previous["pending"] if loc in available}
+        | {loc for loc in added if not excluded(provider, loc)}
+    )
+    removed = sorted(known - available)
+    if added or removed:
+        notes.append(
+            (
+                pulumi.warn,
+                f"{provider} regions changed: "
+                f"added {', '.join(sorted(added)) or 'none'}, "
+                f"removed {', '.join(removed) or 'none'}.",
+            )
+        )
+    gone = [loc for loc in entry["deploy"] if loc not in available]
+    if gone:
+        notes.append(
+            (
+                pulumi.warn,
+                f"{provider} no longer offers {', '.join(gone)}; take them out "
+                f"of `deploy` in {os.path.relpath(CATALOG_PATH, root)}.",
+            )
+        )
+    _store(provider, entry)
+    return entry
+
+
+def locations(provider: str, fetch) -> list[str]:
+    """
+    The regions to deploy `provider` to, from the catalog. `fetch` (the
+    provider's live region lookup) is only called to refresh it.
+    """
+    with _locks[provider]:
+        if provider not in _resolved:
+            entry = load().get(provider)
+            if REFRESH or entry is None:
+                try:
+                    entry = _refresh(provider, fetch, entry)
+                except Exception as e:
+                    # The committed catalog is better than no deploy.
+                    if entry is None:
+                        raise
+                    notes.append(
+                        (
+                            pulumi.warn,
+                            f"Couldn't refresh {provider} regions ({e}), using "
+                            "the committed catalog.",
+                        )
+                    )
+            if entry["pending"]:
+                notes.append(
+                    (
+                        pulumi.warn,
+                        f"{provider} regions not deployed until reviewed: "
+                        f"{', '.join(entry['pending'])}. Move them to `deploy` "
+                        f"or `skip` in {os.path.relpath(CATALOG_PATH, root)}.",
+                    )
+                )
+            _resolved[provider] = entry["deploy"]
+        return _resolved[provider]